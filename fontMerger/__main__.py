@@ -0,0 +1,10 @@
+import os
+import sys
+
+# 支持 python -m fontMerger 方式运行命令行模式
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batch_merge import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+
+# 原子写入文件：先写入同目录下的临时文件，完成后再替换目标文件，避免留下写了一半的文件
+
+def get_umask():
+    # os.umask只能在设置的同时读取，读取后立即恢复
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# 进程的umask，在导入时读取一次，避免多线程写入时临时修改umask
+UMASK = get_umask()
+
+def get_file_mode(path):
+    # 替换已有文件时沿用它的权限，新文件使用按umask计算的普通文件默认权限
+    # mkstemp创建的临时文件只有所有者可以读写，直接替换会让输出文件无法被其他用户读取
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        return 0o666 & ~UMASK
+
+@contextmanager
+def open_atomic(path, mode='wb', sync=True):
+    # 返回临时文件对象，正常结束时设置权限并原子替换path，出错时删除临时文件
+    # sync为真时替换前把数据刷新到磁盘
+    output_dir = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.font_merger_', suffix='.tmp', dir=output_dir)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        os.chmod(temp_path, get_file_mode(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_file_atomic(path, data, sync=True):
+    with open_atomic(path, sync=sync) as f:
+        f.write(data)
@@ -0,0 +1,420 @@
+import os
+import sys
+import json
+import time
+import argparse
+import cProfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from merge_engine import FontMergeEngine, FontMergeError, CONFLICT_OVERRIDE, CONFLICT_POLICIES
+from atomic_file import write_file_atomic
+from source_cache import SourceCache
+from glyph_cache import GlyphSubsetCache
+from font_instance import InstanceCache, format_location
+from web_font import WEB_FORMATS, get_output_flavor, get_web_output_path, compress_font_data, check_web_format, is_web_output_current
+
+# 无界面的批量合并入口，不导入Qt，可在构建机上运行
+#
+# 任务清单（JSON或TOML）示例:
+# {
+#     "jobs": [
+#         {
+#             "output_path": "FiraCodeQiHeiNF-Regular.ttf",
+#             "font_paths": ["FiraCode-Regular.ttf", "HYQiHei-55S.ttf", "SymbolsNerdFontMono-Regular.ttf"],
+#             "font_scale_config": {"HYQiHei-55S.ttf": {"enabled": true, "target_height": 1000}},
+#             "final_font_config": {"font_name": "FiraCodeQiHeiNF", "style_name": "Regular"},
+#             "font_subset_config": {"HYQiHei-55S.ttf": {"blocks": ["CJK Unified Ideographs"], "text_files": ["corpus.txt"]}},
+#             "font_instance_config": {"NotoSansSC-VF.ttf": {"wght": 700}},
+#             "conflict_policy": "override"
+#         }
+#     ]
+# }
+# 相对路径（包括子集配置中的text_files）以清单文件所在目录为基准
+# font_instance_config为可变字体的轴坐标，未指定的轴使用默认值，同一批次中相同的坐标只实例化一次
+# conflict_policy为override（默认，后面的字体覆盖前面字体中相同码位的字形）或keep（保留先合并的字形）
+
+# 每个工作进程中合并源缓存的默认内存上限
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+# 磁盘字形缓存目录的默认大小上限
+DEFAULT_DISK_CACHE_SIZE = 2048 * 1024 * 1024
+# 性能记录文件的扩展名：分阶段的JSON报告，以及cProfile统计（可用pstats或snakeviz查看）
+PROFILE_SUFFIX = '.profile.json'
+CPROFILE_SUFFIX = '.prof'
+
+def make_options(cache_size=DEFAULT_CACHE_SIZE, cache_dir=None, disk_cache_size=DEFAULT_DISK_CACHE_SIZE,
+                 incremental=False, web_formats=None, profile=False, cprofile=False, prepare_workers=0,
+                 memory_budget=None):
+    # 批量运行的选项，会原样传给各个工作进程
+    return {
+        'cache_size': cache_size,
+        'cache_dir': cache_dir,
+        'disk_cache_size': disk_cache_size,
+        'incremental': incremental,
+        'web_formats': list(web_formats or []),
+        'profile': profile,
+        'cprofile': cprofile,
+        # 单个任务在当前进程执行时，用于并行预处理源字体的进程数
+        'prepare_workers': prepare_workers,
+        # 低内存模式的内存预算（字节），为空时按普通模式合并
+        'memory_budget': memory_budget,
+    }
+
+def load_manifest(manifest_path):
+    # 读取任务清单，返回规范化后的任务列表
+    if manifest_path.lower().endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise FontMergeError("读取TOML清单需要Python 3.11及以上版本，请改用JSON清单")
+        with open(manifest_path, 'rb') as f:
+            manifest = tomllib.load(f)
+    else:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    for i, job in enumerate(manifest.get('jobs', [])):
+        if not job.get('output_path'):
+            raise FontMergeError(f"清单中第{i + 1}个任务缺少output_path")
+        jobs.append(dict(
+            parse_job(job, base_dir, f"清单中第{i + 1}个任务"),
+            output_path=os.path.join(base_dir, job['output_path'])
+        ))
+    return jobs
+
+def parse_job(job, base_dir, job_label):
+    # 规范化一个任务的字体路径和各项配置（不包括输出路径），相对路径以base_dir为基准
+    # job_label用于错误信息，如"清单中第1个任务"
+    if not job.get('font_paths'):
+        raise FontMergeError(f"{job_label}缺少font_paths")
+    conflict_policy = job.get('conflict_policy', CONFLICT_OVERRIDE)
+    if conflict_policy not in CONFLICT_POLICIES:
+        raise FontMergeError(f"{job_label}的conflict_policy无效: {conflict_policy}")
+    font_subset_config = {
+        font_name: dict(subset_config, text_files=[
+            os.path.join(base_dir, path) for path in subset_config.get('text_files', [])
+        ])
+        for font_name, subset_config in job.get('font_subset_config', {}).items()
+    }
+    font_instance_config = job.get('font_instance_config', {})
+    for font_name, location in font_instance_config.items():
+        if not isinstance(location, dict) or not all(
+                isinstance(value, (int, float)) and not isinstance(value, bool) for value in location.values()):
+            raise FontMergeError(f"{job_label}中字体 '{font_name}' 的轴坐标无效，应为轴标签到数值的映射")
+    return {
+        'font_paths': [os.path.join(base_dir, path) for path in job['font_paths']],
+        'font_scale_config': job.get('font_scale_config', {}),
+        'final_font_config': job.get('final_font_config', {}),
+        'font_subset_config': font_subset_config,
+        'font_instance_config': font_instance_config,
+        'conflict_policy': conflict_policy,
+    }
+
+def run_merge_job(job, options, source_cache=None, glyph_cache=None, instance_cache=None):
+    # 执行单个合并任务，返回输出路径、耗时和附加说明
+    start_time = time.perf_counter()
+    engine = FontMergeEngine(
+        job['font_paths'],
+        job['output_path'],
+        job['font_scale_config'],
+        job['final_font_config'],
+        source_cache=source_cache,
+        glyph_cache=glyph_cache,
+        incremental=options['incremental'],
+        font_subset_config=job['font_subset_config'],
+        conflict_policy=job['conflict_policy'],
+        prepare_workers=options['prepare_workers'],
+        memory_budget=options['memory_budget'],
+        font_instance_config=job.get('font_instance_config'),
+        instance_cache=instance_cache
+    )
+    profiler = cProfile.Profile() if options['cprofile'] else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        output_path = engine.run()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(job['output_path'] + CPROFILE_SUFFIX)
+    if options['profile']:
+        engine.profile.write_json(job['output_path'] + PROFILE_SUFFIX)
+    note = ''
+    if engine.up_to_date:
+        note = '未变化，已跳过'
+    elif engine.reused_sources:
+        note = f'增量构建，复用了前{engine.reused_sources}个源字体'
+    return output_path, time.perf_counter() - start_time, note
+
+def run_job_batch(jobs, options):
+    # 在工作进程中顺序执行一批任务，批次内共享已解析和已缩放的合并源，以及可变字体的实例
+    # 返回每个任务的(输出路径, 耗时, 错误信息, 附加说明)列表、磁盘缓存的统计信息和实例化的统计信息
+    source_cache = SourceCache(options['cache_size'])
+    instance_cache = InstanceCache()
+    glyph_cache = None
+    if options['cache_dir']:
+        glyph_cache = GlyphSubsetCache(options['cache_dir'], options['disk_cache_size'])
+    results = []
+    try:
+        for job in jobs:
+            try:
+                output_path, elapsed, note = run_merge_job(job, options, source_cache, glyph_cache, instance_cache)
+                results.append((output_path, elapsed, None, note))
+            except FontMergeError as e:
+                results.append((job['output_path'], 0.0, str(e), ''))
+            except Exception as e:
+                results.append((job['output_path'], 0.0, f"处理过程中出错: {str(e)}", ''))
+    finally:
+        source_cache.clear()
+        instance_cache.clear()
+    instance_stats = {'instantiated': instance_cache.instantiated, 'hits': instance_cache.hits}
+    return results, glyph_cache.get_stats() if glyph_cache is not None else None, instance_stats
+
+def run_compress_job(output_path, flavor):
+    # 在工作进程中把一个输出文件压缩为网页字体
+    # 返回(压缩文件路径, 压缩前字节数, 压缩后字节数, 耗时, 错误信息)
+    web_path = get_web_output_path(output_path, flavor)
+    start_time = time.perf_counter()
+    try:
+        with open(output_path, 'rb') as f:
+            font_data = f.read()
+        if get_output_flavor(output_path):
+            # 输出文件本身已经压缩时，先还原为未压缩的字体数据
+            font_data = compress_font_data(font_data, None)
+        web_data = compress_font_data(font_data, flavor)
+        write_file_atomic(web_path, web_data)
+    except Exception as e:
+        return web_path, 0, 0, 0.0, f"压缩时出错: {str(e)}"
+    return web_path, len(font_data), len(web_data), time.perf_counter() - start_time, None
+
+def get_compress_tasks(output_path, web_formats):
+    # 返回输出文件需要的压缩任务，压缩文件已是最新时跳过
+    tasks = []
+    for flavor in web_formats:
+        web_path = get_web_output_path(output_path, flavor)
+        if web_path != output_path and not is_web_output_current(web_path, output_path):
+            tasks.append((output_path, flavor))
+    return tasks
+
+def plan_job_batches(jobs, max_workers):
+    # 把使用相同合并源的任务分到同一批次，使每个合并源在每个工作进程中只解析和缩放一次
+    # 实例化的可变字体（包括基础字体）按(路径, 轴坐标)分组，每个实例在每个工作进程中只实例化一次
+    # 批次数少于进程数时拆分最大的批次，以便用满所有CPU核心
+    parents = list(range(len(jobs)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    owner = {}
+    for i, job in enumerate(jobs):
+        font_instance_config = job.get('font_instance_config') or {}
+        keys = [os.path.realpath(font_path) for font_path in job['font_paths'][1:]]
+        for font_path in job['font_paths']:
+            location = font_instance_config.get(os.path.basename(font_path))
+            if location is not None:
+                keys.append((os.path.realpath(font_path), format_location(location)))
+        for key in keys:
+            if key in owner:
+                parents[find(i)] = find(owner[key])
+            else:
+                owner[key] = i
+
+    groups = {}
+    for i, job in enumerate(jobs):
+        groups.setdefault(find(i), []).append(job)
+    batches = sorted(groups.values(), key=len, reverse=True)
+
+    while len(batches) < max_workers and len(batches[0]) > 1:
+        largest = batches.pop(0)
+        half = len(largest) // 2
+        batches.extend([largest[:half], largest[half:]])
+        batches.sort(key=len, reverse=True)
+    return batches
+
+def run_jobs(jobs, max_workers=None, options=None):
+    # 用进程池并发执行合并任务，返回失败任务的数量
+    # 需要输出网页字体时，每个任务完成后把压缩作为单独的任务提交到同一个进程池
+    options = options or make_options()
+    if not jobs:
+        return 0
+    requested_workers = max_workers or os.cpu_count() or 1
+    max_workers = min(requested_workers, len(jobs))
+
+    failed_outputs = set()
+    cache_stats = {
+        'hits': 0, 'misses': 0, 'evictions': 0, 'layout_hits': 0, 'layout_misses': 0, 'instance_hits': 0,
+        'instance_misses': 0
+    }
+    instance_stats = {'instantiated': 0, 'hits': 0}
+    compress_stats = {'files': 0, 'bytes_in': 0, 'bytes_out': 0, 'elapsed': 0.0}
+
+    def collect(batch_result):
+        # 输出一个批次中各任务的结果，累计失败任务和缓存统计，返回需要执行的压缩任务
+        results, stats, batch_instance_stats = batch_result
+        compress_tasks = []
+        for output_path, elapsed, error, note in results:
+            report_job_result(output_path, elapsed, error, note)
+            if error is not None:
+                failed_outputs.add(output_path)
+            else:
+                compress_tasks.extend(get_compress_tasks(output_path, options['web_formats']))
+        if stats is not None:
+            for key in cache_stats:
+                cache_stats[key] += stats[key]
+        for key in instance_stats:
+            instance_stats[key] += batch_instance_stats[key]
+        return compress_tasks
+
+    def collect_compress(output_path, compress_result):
+        web_path, bytes_in, bytes_out, elapsed, error = compress_result
+        report_compress_result(web_path, bytes_in, bytes_out, elapsed, error)
+        if error is not None:
+            failed_outputs.add(output_path)
+        else:
+            compress_stats['files'] += 1
+            compress_stats['bytes_in'] += bytes_in
+            compress_stats['bytes_out'] += bytes_out
+            compress_stats['elapsed'] += elapsed
+
+    if max_workers == 1:
+        # 只有一个任务或限定单进程时直接在当前进程执行，多余的进程用于并行预处理源字体
+        options = dict(options, prepare_workers=requested_workers)
+        for output_path, flavor in collect(run_job_batch(jobs, options)):
+            collect_compress(output_path, run_compress_job(output_path, flavor))
+    else:
+        batches = plan_job_batches(jobs, max_workers)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # 正在执行的合并批次对应None，压缩任务对应其输出文件路径
+            pending = {executor.submit(run_job_batch, batch, options): None for batch in batches}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    output_path = pending.pop(future)
+                    if output_path is None:
+                        for task in collect(future.result()):
+                            pending[executor.submit(run_compress_job, *task)] = task[0]
+                    else:
+                        collect_compress(output_path, future.result())
+
+    if options['cache_dir']:
+        print(f"磁盘字形缓存: 命中{cache_stats['hits']}次，未命中{cache_stats['misses']}次，"
+              f"淘汰{cache_stats['evictions']}个文件；布局表命中{cache_stats['layout_hits']}次，"
+              f"未命中{cache_stats['layout_misses']}次；可变字体实例命中{cache_stats['instance_hits']}次，"
+              f"未命中{cache_stats['instance_misses']}次")
+    if instance_stats['instantiated'] or instance_stats['hits']:
+        print(f"可变字体实例: 实例化{instance_stats['instantiated']}次，复用{instance_stats['hits']}次")
+    if compress_stats['files']:
+        print(f"网页字体: 共{compress_stats['files']}个文件，{format_size(compress_stats['bytes_in'])} -> "
+              f"{format_size(compress_stats['bytes_out'])}，压缩耗时{compress_stats['elapsed']:.2f}秒")
+    return len(failed_outputs)
+
+def report_job_result(output_path, elapsed, error, note=''):
+    # 输出单个任务的结果
+    if error is not None:
+        print(f"失败: {output_path}: {error}", file=sys.stderr)
+    else:
+        print(f"完成: {output_path} ({elapsed:.2f}秒{'，' + note if note else ''})")
+
+def report_compress_result(web_path, bytes_in, bytes_out, elapsed, error):
+    # 输出单个压缩任务的结果
+    if error is not None:
+        print(f"失败: {web_path}: {error}", file=sys.stderr)
+    else:
+        ratio = bytes_out / bytes_in if bytes_in else 0
+        print(f"压缩: {web_path} ({format_size(bytes_in)} -> {format_size(bytes_out)}，{ratio:.1%}，{elapsed:.2f}秒)")
+
+def format_size(size):
+    return f"{size / 1024:.1f}KB" if size < 1024 * 1024 else f"{size / (1024 * 1024):.2f}MB"
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='fontMerger', description='字体合并工具（命令行模式）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    merge_parser = subparsers.add_parser('merge', help='按任务清单批量合并字体')
+    merge_parser.add_argument('manifest', help='任务清单文件（.json或.toml）')
+    merge_parser.add_argument('-j', '--jobs', type=int, default=None, help='并发进程数，默认等于CPU核心数')
+    merge_parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                              help='每个进程中合并源缓存的内存上限（MB），默认1024')
+    merge_parser.add_argument('--cache-dir', default=None,
+                              help='磁盘字形缓存目录，重复构建时直接复用已解析和缩放的字形')
+    merge_parser.add_argument('--cache-dir-size', type=int, default=DEFAULT_DISK_CACHE_SIZE // (1024 * 1024),
+                              help='磁盘字形缓存目录的大小上限（MB），默认2048')
+    merge_parser.add_argument('--incremental', action='store_true',
+                              help='增量构建：在输出旁记录构建清单，跳过未变化的输出，只重新合并变化的源字体')
+    merge_parser.add_argument('--web-format', dest='web_formats', action='append', choices=WEB_FORMATS, default=[],
+                              help='在每个输出旁额外生成网页字体（woff或woff2），可以重复指定')
+    merge_parser.add_argument('--profile', action='store_true',
+                              help=f'在每个输出旁写入分阶段的耗时、峰值内存和导入数量（{PROFILE_SUFFIX}）')
+    merge_parser.add_argument('--cprofile', action='store_true',
+                              help=f'用cProfile记录每个任务，在输出旁写入统计文件（{CPROFILE_SUFFIX}）')
+    merge_parser.add_argument('--memory-budget', type=int, default=None,
+                              help='低内存模式：每个任务分批处理字形的内存预算（MB），合并后的字形暂存到临时文件')
+
+    serve_parser = subparsers.add_parser('serve', help='以常驻服务的方式接收合并请求（本地HTTP）')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='监听地址，默认127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765, help='监听端口，默认8765')
+    serve_parser.add_argument('--unix', default=None, help='改为监听Unix套接字')
+    serve_parser.add_argument('--font-dir', default='.', help='请求中相对路径的基准目录，默认当前目录')
+    serve_parser.add_argument('--output-dir', required=True, help='合并后的字体的缓存目录')
+    serve_parser.add_argument('--output-cache-size', type=int, default=1024,
+                              help='输出缓存目录的大小上限（MB），默认1024')
+    serve_parser.add_argument('-j', '--jobs', type=int, default=None, help='工作进程数，默认等于CPU核心数')
+    serve_parser.add_argument('--max-queue', type=int, default=64,
+                              help='排队和正在合并的请求数量上限，超过时返回503，默认64')
+    serve_parser.add_argument('--preload', nargs='*', default=[], help='启动时在每个工作进程中预先解析的源字体')
+    serve_parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                              help='每个工作进程中合并源缓存的内存上限（MB），默认1024')
+    serve_parser.add_argument('--cache-dir', default=None, help='磁盘字形缓存目录')
+    serve_parser.add_argument('--cache-dir-size', type=int, default=DEFAULT_DISK_CACHE_SIZE // (1024 * 1024),
+                              help='磁盘字形缓存目录的大小上限（MB），默认2048')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'merge':
+        try:
+            jobs = load_manifest(args.manifest)
+        except (OSError, ValueError, FontMergeError) as e:
+            print(f"读取任务清单失败: {str(e)}", file=sys.stderr)
+            return 2
+        options = make_options(
+            cache_size=args.cache_size * 1024 * 1024,
+            cache_dir=args.cache_dir,
+            disk_cache_size=args.cache_dir_size * 1024 * 1024,
+            incremental=args.incremental,
+            web_formats=args.web_formats,
+            profile=args.profile,
+            cprofile=args.cprofile,
+            memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None
+        )
+        try:
+            for flavor in options['web_formats']:
+                check_web_format(flavor)
+        except (ValueError, RuntimeError) as e:
+            print(str(e), file=sys.stderr)
+            return 2
+        failed = run_jobs(jobs, args.jobs, options)
+        print(f"共{len(jobs)}个任务，成功{len(jobs) - failed}个，失败{failed}个")
+        return 1 if failed else 0
+
+    if args.command == 'serve':
+        # 服务模块使用asyncio和常驻进程池，只在需要时导入
+        from merge_service import MergeService, run_service
+        options = make_options(
+            cache_size=args.cache_size * 1024 * 1024,
+            cache_dir=args.cache_dir,
+            disk_cache_size=args.cache_dir_size * 1024 * 1024
+        )
+        service = MergeService(
+            args.font_dir, args.output_dir, options, workers=args.jobs, max_queue=args.max_queue,
+            output_cache_size=args.output_cache_size * 1024 * 1024, preload_paths=args.preload
+        )
+        run_service(service, args.host, args.port, args.unix)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import fontTools
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from merge_engine import FontMergeEngine, GlyphIndex, CodepointIndex
+
+# 合并热点路径的基准测试：离线生成指定大小的合成字体，分别计时各个合并步骤和完整的run()
+#
+# 用法:
+#   python benchmark.py --sizes 1000,10000,60000 --history bench.jsonl
+#   python benchmark.py --compare bench.jsonl
+# 每次运行的结果（包括当前git提交）追加到历史文件中，--compare与历史文件中的最后一次结果对比
+
+DEFAULT_SIZES = (1000, 10000, 60000)
+DEFAULT_REPEAT = 3
+# 与上次结果相比慢了这么多时标记为性能退化
+REGRESSION_THRESHOLD = 0.10
+
+# 合成字体参数：基础字体模拟编程字体，合并字体模拟CJK字体
+BASE_GLYPH_COUNT = 600
+COMPOSITE_RATIO = 0.05
+SUPPLEMENTARY_RATIO = 0.3
+# 跳过代理区和私用区，BMP码位从CJK扩展A开始分配
+BMP_START = 0x3400
+BMP_SKIP = (0xD800, 0xF900)
+SUPPLEMENTARY_START = 0x20000
+
+def iter_codepoints(count, supplementary_count):
+    # 依次分配BMP码位和辅助平面码位
+    code = BMP_START
+    for _ in range(count - supplementary_count):
+        if BMP_SKIP[0] <= code < BMP_SKIP[1]:
+            code = BMP_SKIP[1]
+        if code > 0xFFFF:
+            raise ValueError("BMP码位不足，请提高辅助平面码位的比例")
+        yield code
+        code += 1
+    for i in range(supplementary_count):
+        yield SUPPLEMENTARY_START + i
+
+def make_box_glyph(size, offset):
+    pen = TTGlyphPen(None)
+    pen.moveTo((offset, 0))
+    pen.lineTo((offset, size))
+    pen.qCurveTo((offset + size // 2, size + size // 4), (offset + size, size))
+    pen.lineTo((offset + size, 0))
+    pen.closePath()
+    return pen.glyph()
+
+def build_synthetic_font(path, glyph_count, prefix, units_per_em=1000, start_code=None,
+                         composite_ratio=COMPOSITE_RATIO, supplementary_ratio=SUPPLEMENTARY_RATIO, vmtx=True):
+    # 生成带有简单字形、复合字形、BMP和辅助平面码位以及vmtx的TrueType字体
+    composite_count = int(glyph_count * composite_ratio)
+    simple_count = glyph_count - composite_count - 1
+    supplementary_count = int(simple_count * supplementary_ratio)
+
+    glyph_order = ['.notdef']
+    glyphs = {'.notdef': make_box_glyph(units_per_em // 2, 50)}
+    metrics = {'.notdef': (units_per_em // 2, 50)}
+    cmap = {}
+    if start_code is None:
+        codes = iter_codepoints(simple_count, supplementary_count)
+    else:
+        codes = range(start_code, start_code + simple_count)
+    for i, code in enumerate(codes):
+        glyph_name = f"{prefix}{i}"
+        glyph_order.append(glyph_name)
+        glyphs[glyph_name] = make_box_glyph(units_per_em // 2 + i % 97, 40 + i % 13)
+        metrics[glyph_name] = (units_per_em, 40 + i % 13)
+        cmap[code] = glyph_name
+    for i in range(composite_count):
+        glyph_name = f"{prefix}c{i}"
+        pen = TTGlyphPen(glyphs)
+        pen.addComponent(glyph_order[1 + i % simple_count], (1, 0, 0, 1, 10, 0))
+        pen.addComponent(glyph_order[1 + (i * 7 + 1) % simple_count], (0.5, 0, 0, 0.5, units_per_em // 2, 0))
+        glyph_order.append(glyph_name)
+        glyphs[glyph_name] = pen.glyph()
+        metrics[glyph_name] = (units_per_em, 10)
+
+    builder = FontBuilder(units_per_em, isTTF=True)
+    builder.setupGlyphOrder(glyph_order)
+    builder.setupCharacterMap(cmap)
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics(metrics)
+    builder.setupHorizontalHeader(ascent=int(units_per_em * 0.88), descent=-int(units_per_em * 0.12))
+    if vmtx:
+        builder.setupVerticalMetrics({glyph_name: (units_per_em, 0) for glyph_name in glyph_order})
+        builder.setupVerticalHeader(ascent=units_per_em // 2, descent=-units_per_em // 2)
+    builder.setupNameTable({'familyName': f"Bench {prefix}", 'styleName': 'Regular'})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(path)
+
+def prepare_fonts(font_dir, sizes):
+    # 生成（或复用已生成的）基础字体和各个大小的合并字体
+    os.makedirs(font_dir, exist_ok=True)
+    base_path = os.path.join(font_dir, 'bench-base.ttf')
+    if not os.path.exists(base_path):
+        build_synthetic_font(base_path, BASE_GLYPH_COUNT, 'base', start_code=0x20, composite_ratio=0.02)
+    donor_paths = {}
+    for size in sizes:
+        donor_path = os.path.join(font_dir, f"bench-donor-{size}.ttf")
+        if not os.path.exists(donor_path):
+            build_synthetic_font(donor_path, size, 'cjk', units_per_em=2048)
+        donor_paths[size] = donor_path
+    return base_path, donor_paths
+
+class MergeState:
+    # 已加载的基础字体和合并字体，以及初始化好索引的引擎，模拟合并过程中的状态
+    def __init__(self, base_path, donor_path, output_path):
+        self.engine = FontMergeEngine([base_path, donor_path], output_path)
+        self.base_font = self.engine.load_font(base_path)
+        self.engine.preload_glyph_count_tables(self.base_font)
+        self.engine.glyph_index = GlyphIndex(self.base_font)
+        self.engine.codepoint_index = CodepointIndex(self.base_font)
+        self.donor_font = self.engine.load_font(donor_path)
+        self.glyph_names = self.engine.select_source_glyphs(self.donor_font)
+        self.engine.glyph_index.begin_source(self.glyph_names)
+
+    def merge_glyphs(self):
+        self.engine.merge_glyphs(self.base_font, self.donor_font, self.glyph_names)
+
+    def merge_all(self):
+        self.engine.merge_font_data(self.base_font, self.donor_font, self.glyph_names, raw_glyphs=True)
+
+    def close(self):
+        self.base_font.close()
+        self.donor_font.close()
+
+def bench_merge_glyphs(state):
+    state.merge_glyphs()
+
+def bench_merge_raw_glyphs(state):
+    state.engine.merge_raw_glyphs(state.base_font, state.donor_font, state.glyph_names)
+
+def setup_after_glyphs(state):
+    state.merge_glyphs()
+
+def bench_merge_hmtx(state):
+    state.engine.merge_hmtx(state.base_font, state.donor_font)
+
+def bench_merge_cmaps(state):
+    state.engine.merge_cmaps(state.base_font, state.donor_font)
+
+def bench_scale_font_glyphs(state):
+    state.engine.scale_font_glyphs(state.donor_font, 1000 / 2048, state.glyph_names)
+
+def setup_after_merge(state):
+    state.merge_all()
+
+def bench_finalize_font_tables(state):
+    state.engine.finalize_font_tables(state.base_font)
+
+def bench_run(state):
+    state.engine.run()
+
+def bench_run_scaled(state):
+    state.engine.font_scale_config = {
+        os.path.basename(state.engine.font_paths[1]): {'enabled': True, 'target_height': 1000}
+    }
+    state.engine.run()
+
+# (名称, 计时前的准备, 计时的函数)
+BENCHMARKS = [
+    ('merge_glyphs', None, bench_merge_glyphs),
+    ('merge_raw_glyphs', None, bench_merge_raw_glyphs),
+    ('merge_hmtx', setup_after_glyphs, bench_merge_hmtx),
+    ('merge_cmaps', setup_after_glyphs, bench_merge_cmaps),
+    ('scale_font_glyphs', None, bench_scale_font_glyphs),
+    ('finalize_font_tables', setup_after_merge, bench_finalize_font_tables),
+    ('run', None, bench_run),
+    ('run_scaled', None, bench_run_scaled),
+]
+
+def measure(base_path, donor_path, output_path, setup, func, repeat):
+    # 每次重复都重新加载字体，返回各次耗时以及单独一次运行中Python分配的峰值内存
+    times = []
+    for i in range(repeat + 1):
+        state = MergeState(base_path, donor_path, output_path)
+        try:
+            if setup is not None:
+                setup(state)
+            trace_memory = i == repeat
+            if trace_memory:
+                # 最后一次只统计内存，tracemalloc会拖慢执行，不计入耗时
+                tracemalloc.start()
+            start_time = time.perf_counter()
+            func(state)
+            elapsed = time.perf_counter() - start_time
+            if trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                times.append(elapsed)
+        finally:
+            state.close()
+    return times, peak_memory
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes, repeat, font_dir, names=None):
+    base_path, donor_paths = prepare_fonts(font_dir, sizes)
+    output_path = os.path.join(font_dir, 'bench-output.ttf')
+    results = []
+    for size in sizes:
+        for name, setup, func in BENCHMARKS:
+            if names and name not in names:
+                continue
+            times, peak_memory = measure(base_path, donor_paths[size], output_path, setup, func, repeat)
+            best = min(times)
+            result = {
+                'name': name,
+                'glyphs': size,
+                'best': best,
+                'mean': sum(times) / len(times),
+                'glyphs_per_second': size / best if best else None,
+                'peak_memory': peak_memory,
+            }
+            results.append(result)
+            print(format_result(result), flush=True)
+    return {
+        'commit': get_git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'fonttools': fontTools.version,
+        'repeat': repeat,
+        'results': results,
+    }
+
+def format_result(result):
+    return (f"{result['name']:<22}{result['glyphs']:>7}个字形  最快{result['best'] * 1000:>9.1f}ms  "
+            f"平均{result['mean'] * 1000:>9.1f}ms  {result['glyphs_per_second'] or 0:>11.0f}字形/秒  "
+            f"峰值{result['peak_memory'] / (1024 * 1024):>7.1f}MB")
+
+def load_history(history_path):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def append_history(history_path, run):
+    with open(history_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run, ensure_ascii=False) + '\n')
+
+def compare_runs(previous, current, threshold=REGRESSION_THRESHOLD):
+    # 按(名称, 字形数量)对比最快耗时，返回性能退化的项目数量
+    previous_results = {(result['name'], result['glyphs']): result for result in previous['results']}
+    print(f"与提交 {previous.get('commit') or '未知'}（{previous['time']}）对比:")
+    regressions = 0
+    for result in current['results']:
+        previous_result = previous_results.get((result['name'], result['glyphs']))
+        if previous_result is None:
+            continue
+        ratio = result['best'] / previous_result['best'] if previous_result['best'] else 1.0
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  <- 变慢'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = '  <- 变快'
+        print(f"  {result['name']:<22}{result['glyphs']:>7}个字形  {ratio:>6.2f}x{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='字体合并基准测试')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='合并字体的字形数量，逗号分隔，默认1000,10000,60000')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='每项重复次数，默认3')
+    parser.add_argument('--only', default=None, help='只运行指定的项目，逗号分隔')
+    parser.add_argument('--font-dir', default=None, help='合成字体的保存目录，指定后可以在多次运行之间复用')
+    parser.add_argument('--history', default=None, help='把本次结果追加到历史文件（JSON Lines）')
+    parser.add_argument('--compare', default=None, help='与历史文件中的最后一次结果对比，有退化时返回1')
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        # 至少需要一次计时运行，统计内存的那次运行不计入耗时
+        parser.error('--repeat 至少为1')
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    names = set(args.only.split(',')) if args.only else None
+    if args.font_dir:
+        run = run_benchmarks(sizes, args.repeat, args.font_dir, names)
+    else:
+        with tempfile.TemporaryDirectory() as font_dir:
+            run = run_benchmarks(sizes, args.repeat, font_dir, names)
+
+    regressions = 0
+    if args.compare:
+        history = load_history(args.compare)
+        if history:
+            regressions = compare_runs(history[-1], run)
+        else:
+            print(f"历史文件为空: {args.compare}")
+    if args.history:
+        append_history(args.history, run)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
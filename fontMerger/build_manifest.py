@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+from codepoint_set import hash_codepoint_set
+
+# 增量构建清单：记录一次合并的输入哈希、配置以及每个源字体贡献的字形范围
+# 保存在输出文件旁边，重新构建时据此跳过未变化的输出，或只重新合并变化的源字体
+
+MANIFEST_VERSION = 5
+MANIFEST_SUFFIX = '.build.json'
+
+def get_manifest_path(output_path):
+    return output_path + MANIFEST_SUFFIX
+
+def hash_file(path):
+    # 分块计算文件的SHA-256，与source_cache.hash_font_data的结果一致
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class BuildManifest:
+    def __init__(self, sources, final_font_config, output_hash=None, conflict_policy=None):
+        # sources中每一项为{'path', 'hash', 'scale_config', 'subset_hash', 'instance_location', 'glyph_range',
+        # 'cmap_overrides', 'layout_merged', 'names_merged'}，instance_location为可变字体配置的轴坐标
+        # glyph_range为该源字体在输出中占用的GID范围[start, end)
+        # cmap_overrides为该源字体覆盖的码位及其原来映射的字形名称，layout_merged表示是否合并了它的布局表
+        # names_merged表示是否向name表添加了它的名称记录
+        self.sources = sources
+        self.final_font_config = final_font_config
+        self.output_hash = output_hash
+        self.conflict_policy = conflict_policy
+
+    @classmethod
+    def from_inputs(cls, font_paths, font_scale_config, final_font_config, source_codepoints=None,
+                    conflict_policy=None, font_instance_config=None):
+        # source_codepoints为字体文件名到子集码位集合的映射
+        source_codepoints = source_codepoints or {}
+        font_instance_config = font_instance_config or {}
+        sources = [
+            {
+                'path': os.path.abspath(font_path),
+                'hash': hash_file(font_path),
+                'scale_config': font_scale_config.get(os.path.basename(font_path)),
+                'subset_hash': hash_codepoint_set(source_codepoints.get(os.path.basename(font_path))),
+                'instance_location': font_instance_config.get(os.path.basename(font_path)),
+                'glyph_range': None,
+                'cmap_overrides': None,
+                'layout_merged': False,
+                'names_merged': False,
+            }
+            for font_path in font_paths
+        ]
+        return cls(sources, dict(final_font_config), conflict_policy=conflict_policy)
+
+    @classmethod
+    def load(cls, path):
+        # 清单不存在或无法解析时返回None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != MANIFEST_VERSION:
+            return None
+        return cls(data['sources'], data['final_font_config'], data.get('output_hash'), data.get('conflict_policy'))
+
+    def to_json(self):
+        return json.dumps({
+            'version': MANIFEST_VERSION,
+            'output_hash': self.output_hash,
+            'conflict_policy': self.conflict_policy,
+            'final_font_config': self.final_font_config,
+            'sources': self.sources,
+        }, ensure_ascii=False, indent=2)
+
+    def first_changed_source(self, current):
+        # 返回第一个内容、缩放配置、子集码位或轴坐标发生变化的源字体序号，全部相同时返回None
+        # 源字体数量不同时，多出或缺少的第一个位置也视为变化，码位冲突策略变化时需要完整重新合并
+        if self.conflict_policy != current.conflict_policy:
+            return 0
+        for i, (previous_source, current_source) in enumerate(zip(self.sources, current.sources)):
+            if (previous_source['hash'] != current_source['hash']
+                    or previous_source['scale_config'] != current_source['scale_config']
+                    or previous_source.get('subset_hash') != current_source['subset_hash']
+                    or previous_source.get('instance_location') != current_source['instance_location']):
+                return i
+        if len(self.sources) != len(current.sources):
+            return min(len(self.sources), len(current.sources))
+        return None
+
+    def is_up_to_date(self, current):
+        return self.first_changed_source(current) is None and self.final_font_config == current.final_font_config
@@ -0,0 +1,83 @@
+import hashlib
+from array import array
+from fontTools.unicodedata import Blocks
+
+# 子集码位集合：按Unicode区块、码位范围和文本语料文件指定每个源字体需要保留的码位
+#
+# 配置示例:
+# {
+#     "unicodes": ["U+0020-007E", "U+3000-303F"],
+#     "blocks": ["CJK Unified Ideographs"],
+#     "text_files": ["corpus.txt"],
+#     "text": "直接给出的文本"
+# }
+# 各种方式的码位取并集
+
+# Unicode码位上限
+MAX_CODEPOINT = 0x10FFFF
+
+def parse_codepoint(text):
+    # 解析单个码位，支持U+4E00、0x4E00和4E00三种写法
+    text = text.strip().upper()
+    if text.startswith('U+'):
+        text = text[2:]
+    elif text.startswith('0X'):
+        text = text[2:]
+    code = int(text, 16)
+    if not 0 <= code <= MAX_CODEPOINT:
+        raise ValueError(f"码位超出范围: {text}")
+    return code
+
+def parse_codepoint_ranges(spec):
+    # 解析码位范围列表，spec可以是逗号或空白分隔的字符串，也可以是字符串和整数组成的列表
+    if isinstance(spec, str):
+        items = spec.replace(',', ' ').split()
+    else:
+        items = spec
+    codepoints = set()
+    for item in items:
+        if isinstance(item, int):
+            codepoints.add(item)
+            continue
+        start, _, end = item.partition('-')
+        start = parse_codepoint(start)
+        end = parse_codepoint(end) if end else start
+        if end < start:
+            raise ValueError(f"码位范围无效: {item}")
+        codepoints.update(range(start, end + 1))
+    return codepoints
+
+def get_block_codepoints(block_name):
+    # 返回Unicode区块中的所有码位，区块名称不区分大小写
+    target = block_name.strip().lower()
+    for i, value in enumerate(Blocks.VALUES):
+        if value.lower() == target and value != 'No_Block':
+            end = Blocks.RANGES[i + 1] if i + 1 < len(Blocks.RANGES) else MAX_CODEPOINT + 1
+            return set(range(Blocks.RANGES[i], end))
+    raise ValueError(f"未知的Unicode区块: {block_name}")
+
+def read_text_codepoints(text_path):
+    # 返回文本文件中出现过的所有字符（换行符除外）
+    with open(text_path, 'r', encoding='utf-8-sig') as f:
+        codepoints = {ord(char) for char in f.read()}
+    codepoints.difference_update((0x0A, 0x0D))
+    return codepoints
+
+def load_codepoint_set(subset_config):
+    # 根据子集配置返回码位集合
+    codepoints = set()
+    if subset_config.get('unicodes'):
+        codepoints.update(parse_codepoint_ranges(subset_config['unicodes']))
+    for block_name in subset_config.get('blocks', []):
+        codepoints.update(get_block_codepoints(block_name))
+    for text_path in subset_config.get('text_files', []):
+        codepoints.update(read_text_codepoints(text_path))
+    if subset_config.get('text'):
+        codepoints.update(ord(char) for char in subset_config['text'] if char not in '\r\n')
+    return codepoints
+
+def hash_codepoint_set(codepoints):
+    # 码位集合的内容哈希，用于判断子集配置（包括语料文件内容）是否变化
+    if codepoints is None:
+        return None
+    return hashlib.sha256(array('I', sorted(codepoints)).tobytes()).hexdigest()
@@ -0,0 +1,105 @@
+import io
+import hashlib
+from collections import OrderedDict
+from fontTools.ttLib import TTFont
+from fontTools.varLib.instancer import instantiateVariableFont
+
+# 可变字体实例化：按配置的轴坐标（如wght=700）把可变字体实例化为静态字体后再合并
+# 实例按(源字体内容哈希, 完整轴坐标)缓存，批量构建同一字族的多个字重时每个坐标只实例化一次
+
+# 进程内实例缓存的默认内存上限
+DEFAULT_INSTANCE_CACHE_SIZE = 512 * 1024 * 1024
+
+def is_variable_font(font):
+    return 'fvar' in font
+
+def resolve_location(font, location):
+    # 返回所有轴的坐标：未指定的轴使用默认值，超出范围的坐标限制在轴的范围内
+    # 坐标中有字体不存在的轴时抛出ValueError
+    axes = {axis.axisTag: axis for axis in font['fvar'].axes}
+    unknown_tags = [tag for tag in location if tag not in axes]
+    if unknown_tags:
+        raise ValueError(f"字体没有轴 {', '.join(unknown_tags)}，可用的轴: {', '.join(axes)}")
+    resolved = {}
+    for tag, axis in axes.items():
+        value = float(location.get(tag, axis.defaultValue))
+        if not axis.minValue <= value <= axis.maxValue:
+            print(f"警告: 轴{tag}的坐标{value:g}超出范围[{axis.minValue:g}, {axis.maxValue:g}]，已限制在范围内")
+            value = min(max(value, axis.minValue), axis.maxValue)
+        resolved[tag] = value
+    return resolved
+
+def format_location(location):
+    # 按轴标签排序的文本形式，如"wdth=100,wght=700"
+    return ','.join(f"{tag}={value:g}" for tag, value in sorted(location.items()))
+
+def parse_location(text):
+    # 解析"wght=700, wdth=75"形式的轴坐标，返回轴标签到坐标的映射
+    location = {}
+    for item in text.replace('，', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        tag, separator, value = item.partition('=')
+        tag = tag.strip()
+        if not separator or not tag:
+            raise ValueError(f"无效的轴坐标: {item}")
+        try:
+            location[tag] = float(value)
+        except ValueError:
+            raise ValueError(f"无效的轴坐标: {item}") from None
+    return location
+
+def make_instance_key(content_hash, location):
+    # 实例的缓存键，location为resolve_location返回的完整坐标
+    # 实例化后的字体用它代替内容哈希，字形子集缓存和布局表缓存也按实例区分
+    return hashlib.sha256(f"{content_hash}@{format_location(location)}".encode('utf-8')).hexdigest()
+
+def instantiate_font_data(data, location):
+    # 把可变字体数据实例化为静态字体，返回编译后的字体数据
+    font = TTFont(io.BytesIO(data))
+    try:
+        instantiateVariableFont(font, location, inplace=True)
+        output = io.BytesIO()
+        font.save(output)
+        return output.getvalue()
+    finally:
+        font.close()
+
+class InstanceCache:
+    # 进程内的实例缓存，按实例键保存实例化后的字体数据，超过内存上限时按LRU淘汰
+    def __init__(self, max_bytes=DEFAULT_INSTANCE_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.hits = 0
+        # 实际执行实例化的次数（内存和磁盘缓存都未命中）
+        self.instantiated = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        if key in self.entries:
+            self.total_size -= len(self.entries[key])
+        self.entries[key] = data
+        self.entries.move_to_end(key)
+        self.total_size += len(data)
+        # 淘汰最久未使用的实例，但始终保留最近使用的一项
+        while self.total_size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_size -= len(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.total_size = 0
@@ -0,0 +1,273 @@
+import copy
+import struct
+import tempfile
+from fontTools.ttLib import getTableClass
+from fontTools.ttLib.sfnt import SFNTWriter, calcChecksum
+from fontTools.ttLib.tables._g_l_y_f import Glyph
+from glyph_data import GLYPH_HEADER_SIZE, is_composite_data, get_component_gids
+
+# 低内存模式：编译好的字形数据暂存到临时文件，保存时逐个字形流式写出glyf表，
+# 不在内存中编译整个glyf表，也不把所有字形解码为Python对象
+
+# 复制表数据时每次读取的字节数（4的倍数，便于分块计算校验和）
+STREAM_CHUNK_SIZE = 1024 * 1024
+# 奇数长度的字形补齐为偶数长度，字体较小时loca表可以使用短偏移（fontTools在放得下时也这样补齐）
+# glyf表设置了更大的padding时按设置对齐
+GLYF_PADDING = 2
+
+class GlyphSpill:
+    # 存放在临时文件中的字形数据，内存中只保留每个字形的偏移和长度
+    # 读取时使用按位置读取而不是mmap，映射的页面也会计入进程的常驻内存
+    def __init__(self, temp_dir=None):
+        self.file = tempfile.TemporaryFile(dir=temp_dir)
+        self.records = {}
+        self.size = 0
+
+    def __contains__(self, glyph_name):
+        return glyph_name in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def put(self, glyph_name, data):
+        self.file.seek(self.size)
+        self.file.write(data)
+        self.records[glyph_name] = (self.size, len(data))
+        self.size += len(data)
+
+    def get(self, glyph_name):
+        offset, length = self.records[glyph_name]
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def close(self):
+        self.file.close()
+        self.records = {}
+
+class GlyfStats:
+    # 按字形顺序逐个累计编译后字形数据的统计，结果与fontTools保存时重新计算的maxp、head、hhea和vhea字段一致
+    # 只读取字形头、轮廓终点和组件列表，不解码坐标
+    def __init__(self, hmtx_metrics, vmtx_metrics=None):
+        self.hmtx_metrics = hmtx_metrics
+        self.vmtx_metrics = vmtx_metrics
+        self.bounds = None
+        self.all_x_min_is_lsb = True
+        self.max_points = 0
+        self.max_contours = 0
+        # 简单字形的(点数, 轮廓数)，复合字形的组件GID列表，按GID保存
+        self.simple_values = {}
+        self.composite_components = {}
+        self.min_lsb = self.min_rsb = self.max_x_extent = None
+        self.min_tsb = self.min_bsb = self.max_y_extent = None
+
+    def add(self, gid, glyph_name, data):
+        if len(data) < GLYPH_HEADER_SIZE:
+            return
+        number_of_contours, x_min, y_min, x_max, y_max = struct.unpack_from('>hhhhh', data, 0)
+        if number_of_contours == 0:
+            return
+        if self.bounds is None:
+            self.bounds = [x_min, y_min, x_max, y_max]
+        else:
+            bounds = self.bounds
+            bounds[0] = min(bounds[0], x_min)
+            bounds[1] = min(bounds[1], y_min)
+            bounds[2] = max(bounds[2], x_max)
+            bounds[3] = max(bounds[3], y_max)
+
+        advance, lsb = self.hmtx_metrics[glyph_name]
+        if lsb != x_min:
+            self.all_x_min_is_lsb = False
+        rsb = advance - lsb - (x_max - x_min)
+        extent = lsb + (x_max - x_min)
+        if self.min_lsb is None:
+            self.min_lsb, self.min_rsb, self.max_x_extent = lsb, rsb, extent
+        else:
+            self.min_lsb = min(self.min_lsb, lsb)
+            self.min_rsb = min(self.min_rsb, rsb)
+            self.max_x_extent = max(self.max_x_extent, extent)
+        if self.vmtx_metrics is not None:
+            advance_height, tsb = self.vmtx_metrics[glyph_name]
+            bsb = advance_height - tsb - (y_max - y_min)
+            extent = tsb + (y_max - y_min)
+            if self.min_tsb is None:
+                self.min_tsb, self.min_bsb, self.max_y_extent = tsb, bsb, extent
+            else:
+                self.min_tsb = min(self.min_tsb, tsb)
+                self.min_bsb = min(self.min_bsb, bsb)
+                self.max_y_extent = max(self.max_y_extent, extent)
+
+        if number_of_contours > 0:
+            # 最后一个轮廓的终点序号加一即为点数
+            points = struct.unpack_from('>H', data, GLYPH_HEADER_SIZE + 2 * (number_of_contours - 1))[0] + 1
+            self.simple_values[gid] = (points, number_of_contours)
+            self.max_points = max(self.max_points, points)
+            self.max_contours = max(self.max_contours, number_of_contours)
+        elif is_composite_data(data):
+            self.composite_components[gid] = get_component_gids(data)
+
+    def get_composite_values(self, gid, memo):
+        # 返回复合字形展开后的(点数, 轮廓数, 嵌套层数)，与Glyph.getCompositeMaxpValues一致
+        if gid in memo:
+            return memo[gid]
+        points = contours = 0
+        depth = 0
+        for component_gid in self.composite_components[gid]:
+            if component_gid in self.simple_values:
+                component_points, component_contours = self.simple_values[component_gid]
+            elif component_gid in self.composite_components:
+                component_points, component_contours, component_depth = self.get_composite_values(component_gid, memo)
+                depth = max(depth, component_depth + 1)
+            else:
+                continue
+            points += component_points
+            contours += component_contours
+        memo[gid] = (points, contours, depth)
+        return memo[gid]
+
+    def apply(self, font):
+        # 把统计结果写入maxp、head、hhea和vhea，对应保存时recalcBBoxes的重新计算
+        head = font['head']
+        if self.bounds is None:
+            head.xMin = head.yMin = head.xMax = head.yMax = 0
+        else:
+            head.xMin, head.yMin, head.xMax, head.yMax = self.bounds
+        if self.all_x_min_is_lsb:
+            head.flags |= 0x2
+        else:
+            head.flags &= ~0x2
+
+        maxp = font['maxp']
+        maxp.numGlyphs = len(font.getGlyphOrder())
+        if maxp.tableVersion >= 0x00010000:
+            memo = {}
+            composite_values = [self.get_composite_values(gid, memo) for gid in self.composite_components]
+            maxp.maxPoints = self.max_points
+            maxp.maxContours = self.max_contours
+            maxp.maxCompositePoints = max((values[0] for values in composite_values), default=0)
+            maxp.maxCompositeContours = max((values[1] for values in composite_values), default=0)
+            maxp.maxComponentElements = max(
+                (len(components) for components in self.composite_components.values()), default=0
+            )
+            maxp.maxComponentDepth = max((values[2] + 1 for values in composite_values), default=0)
+
+        if 'hhea' in font and self.hmtx_metrics:
+            hhea = font['hhea']
+            hhea.advanceWidthMax = max(advance for advance, _ in self.hmtx_metrics.values())
+            hhea.minLeftSideBearing = self.min_lsb or 0
+            hhea.minRightSideBearing = self.min_rsb or 0
+            hhea.xMaxExtent = self.max_x_extent or 0
+        if 'vhea' in font and self.vmtx_metrics:
+            vhea = font['vhea']
+            vhea.advanceHeightMax = max(advance for advance, _ in self.vmtx_metrics.values())
+            vhea.minTopSideBearing = self.min_tsb or 0
+            vhea.minBottomSideBearing = self.min_bsb or 0
+            vhea.yMaxExtent = self.max_y_extent or 0
+
+def update_glyf_stats(font):
+    # 普通模式保存前调用：按字形顺序从编译后的字形数据一次累计统计并写入各表，然后关闭font.recalcBBoxes，
+    # 保存时fontTools不再逐个解码所有字形重新计算
+    # 已解码的字形（缩放、转换或改写了组件的字形）在这里编译一次并替换为只包含编译结果的新字形，保存时直接使用
+    # 这些字形可能仍由合并源缓存中的源字体持有，编译副本而不在原对象上compact，
+    # 否则复合字形会以基础字体的组件GID留在缓存中
+    # 简单字形在缩放或转换时已经计算了边界，只有复合字形需要根据组件重新计算
+    glyf_table = font['glyf']
+    hmtx_metrics = font['hmtx'].metrics if 'hmtx' in font else {}
+    vmtx_metrics = font['vmtx'].metrics if 'vmtx' in font else None
+    stats = GlyfStats(hmtx_metrics, vmtx_metrics)
+    for gid, glyph_name in enumerate(font.getGlyphOrder()):
+        glyph = glyf_table.glyphs[glyph_name]
+        data = getattr(glyph, 'data', None)
+        if data is None:
+            data = copy.copy(glyph).compile(glyf_table, glyph.isComposite())
+            glyf_table.glyphs[glyph_name] = Glyph(data)
+        stats.add(gid, glyph_name, data)
+    stats.apply(font)
+    font.recalcBBoxes = False
+
+def write_glyf_stream(glyph_order, get_glyph_data, stats, glyf_file, padding=GLYF_PADDING):
+    # 按字形顺序把字形数据（按padding对齐）写入glyf_file，同时累计统计，返回loca偏移列表
+    locations = []
+    location = 0
+    for gid, glyph_name in enumerate(glyph_order):
+        data = get_glyph_data(glyph_name)
+        stats.add(gid, glyph_name, data)
+        pad_size = -len(data) % padding
+        glyf_file.write(data)
+        if pad_size:
+            glyf_file.write(b'\0' * pad_size)
+        locations.append(location)
+        location += len(data) + pad_size
+    if location == 0:
+        # 与fontTools一致，所有字形都为空时写入一个零字节
+        glyf_file.write(b'\0')
+    locations.append(location)
+    return locations
+
+class StreamingSFNTWriter(SFNTWriter):
+    # 可以从文件分块写入表数据的SFNTWriter，只支持未压缩的字体
+    def write_stream(self, tag, stream, length):
+        if tag in self.tables:
+            raise ValueError(f"表'{tag}'已写入")
+        entry = self.DirectoryEntry()
+        entry.tag = tag
+        entry.offset = self.nextTableOffset
+        entry.length = length
+        checksum = 0
+        stream.seek(0)
+        self.file.seek(entry.offset)
+        remaining = length
+        while remaining:
+            chunk = stream.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"表'{tag}'的数据不完整")
+            checksum = (checksum + calcChecksum(chunk)) & 0xFFFFFFFF
+            self.file.write(chunk)
+            remaining -= len(chunk)
+        entry.checkSum = checksum
+        self.nextTableOffset += (length + 3) & ~3
+        self.file.write(b'\0' * (self.nextTableOffset - self.file.tell()))
+        self.setEntry(tag, entry)
+
+def save_font_streamed(font, file, glyf_file, glyf_length):
+    # 与TTFont.save相同的顺序和依赖关系写出所有表，glyf表从glyf_file分块复制
+    # 调用前需要设置好loca，并关闭font.recalcBBoxes（对应的字段由GlyfStats计算）
+    tags = font.keys()
+    tags.remove('GlyphOrder')
+    writer = StreamingSFNTWriter(file, len(tags), font.sfntVersion)
+    done = []
+
+    def write_table(tag):
+        if tag in done:
+            return
+        for master_tag in getTableClass(tag).dependencies:
+            if master_tag not in done:
+                if master_tag in font:
+                    write_table(master_tag)
+                else:
+                    done.append(master_tag)
+        done.append(tag)
+        if tag == 'glyf':
+            writer.write_stream(tag, glyf_file, glyf_length)
+        else:
+            writer[tag] = font.getTableData(tag)
+
+    for tag in tags:
+        write_table(tag)
+    writer.close()
+
+def write_font_streamed(font, file, get_glyph_data, temp_dir=None):
+    # 把字体写入可读写的文件对象file，glyf表先写入temp_dir中的临时文件再分块复制
+    # get_glyph_data(字形名称)返回编译好的字形数据
+    with tempfile.TemporaryFile(dir=temp_dir) as glyf_file:
+        hmtx_metrics = font['hmtx'].metrics if 'hmtx' in font else {}
+        vmtx_metrics = font['vmtx'].metrics if 'vmtx' in font else None
+        stats = GlyfStats(hmtx_metrics, vmtx_metrics)
+        padding = max(getattr(font['glyf'], 'padding', 1), GLYF_PADDING)
+        locations = write_glyf_stream(font.getGlyphOrder(), get_glyph_data, stats, glyf_file, padding)
+        stats.apply(font)
+        font['loca'].set(locations)
+        if 'OS/2' in font:
+            font['OS/2'].updateFirstAndLastCharIndex(font)
+        font.recalcBBoxes = False
+        save_font_streamed(font, file, glyf_file, max(locations[-1], 1))
@@ -0,0 +1,313 @@
+import os
+import mmap
+import struct
+import numpy as np
+from glyph_data import is_composite_data, get_component_gids
+from atomic_file import write_file_atomic
+
+# 磁盘上的字形子集缓存：按(源字体内容哈希, 缩放比例)保存已编译的字形数据、度量和cmap切片
+# 文件格式为紧凑的二进制布局，通过mmap读取，记录数组直接映射为NumPy结构化数组
+#
+# 文件布局:
+#   文件头       HEADER_FORMAT
+#   字形名称     源字体完整的字形顺序，UTF-8编码，以\0分隔
+#   字形记录     GLYPH_RECORD_DTYPE数组
+#   cmap记录     CMAP_RECORD_DTYPE数组
+#   字形数据     编译后的glyf数据，复合字形中的组件GID为源字体中的GID
+
+CACHE_MAGIC = b'HFGS'
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.glyphs'
+# 重映射后的布局表（见layout_merge.py）与字形子集保存在同一目录，一起按最近使用时间淘汰
+LAYOUT_SUFFIX = '.layout'
+# 可变字体实例化后的字体数据（见font_instance.py）
+INSTANCE_SUFFIX = '.instance'
+# magic, version, flags, 名称数量, 字形记录数量, cmap记录数量, 名称区长度, 字形数据区长度
+HEADER_FORMAT = '>4sHHIIIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FLAG_HAS_VMTX = 0x0001
+
+GLYPH_RECORD_DTYPE = np.dtype([
+    ('name_index', '>u4'),
+    ('offset', '>u4'),
+    ('length', '>u4'),
+    ('advance', '>u2'),
+    ('lsb', '>i2'),
+    ('v_advance', '>u2'),
+    ('tsb', '>i2'),
+])
+CMAP_RECORD_DTYPE = np.dtype([
+    ('code', '>u4'),
+    ('name_index', '>u4'),
+])
+
+def make_cache_key(content_hash, scale_factor):
+    return f"{content_hash}-{scale_factor:.6f}"
+
+def build_subset_data(glyph_order, glyphs, cmap, has_vmtx):
+    # glyphs为(字形名称, 编译后的数据, (advance, lsb), (v_advance, tsb)或None)的列表
+    # cmap为码位到字形名称的映射
+    name_indices = {glyph_name: i for i, glyph_name in enumerate(glyph_order)}
+    names_data = '\0'.join(glyph_order).encode('utf-8')
+
+    records = []
+    blobs = []
+    offset = 0
+    for glyph_name, data, (advance, lsb), vertical_metrics in glyphs:
+        v_advance, tsb = vertical_metrics or (0, 0)
+        records.append((name_indices[glyph_name], offset, len(data), advance, lsb, v_advance, tsb))
+        blobs.append(data)
+        offset += len(data)
+    glyph_records = np.array(records, dtype=GLYPH_RECORD_DTYPE)
+    cmap_records = np.array(
+        [(code, name_indices[glyph_name]) for code, glyph_name in cmap.items() if glyph_name in name_indices],
+        dtype=CMAP_RECORD_DTYPE,
+    )
+
+    header = struct.pack(
+        HEADER_FORMAT, CACHE_MAGIC, CACHE_VERSION, FLAG_HAS_VMTX if has_vmtx else 0,
+        len(glyph_order), len(glyph_records), len(cmap_records), len(names_data), offset
+    )
+    return b''.join([header, names_data, glyph_records.tobytes(), cmap_records.tobytes()] + blobs)
+
+class GlyphSubset:
+    # 通过mmap打开的缓存条目，用完后需要调用close
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise
+        try:
+            self.parse()
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def from_bytes(cls, data):
+        # 从内存中的数据创建条目（工作进程预处理的结果），不对应缓存文件
+        subset = cls.__new__(cls)
+        subset.file = None
+        subset.buffer = data
+        subset.parse()
+        return subset
+
+    def parse(self):
+        magic, version, flags, num_names, num_glyphs, num_codes, names_size, blobs_size = \
+            struct.unpack_from(HEADER_FORMAT, self.buffer, 0)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            raise ValueError("字形缓存文件格式不匹配")
+        self.has_vmtx = bool(flags & FLAG_HAS_VMTX)
+
+        pos = HEADER_SIZE
+        self.glyph_order = self.buffer[pos:pos + names_size].decode('utf-8').split('\0') if num_names else []
+        if len(self.glyph_order) != num_names:
+            raise ValueError("字形缓存文件已损坏")
+        pos += names_size
+        self.glyph_records = np.frombuffer(self.buffer, dtype=GLYPH_RECORD_DTYPE, count=num_glyphs, offset=pos)
+        pos += self.glyph_records.nbytes
+        self.cmap_records = np.frombuffer(self.buffer, dtype=CMAP_RECORD_DTYPE, count=num_codes, offset=pos)
+        pos += self.cmap_records.nbytes
+        self.blob_offset = pos
+        if pos + blobs_size != len(self.buffer):
+            raise ValueError("字形缓存文件已损坏")
+
+        glyph_order = self.glyph_order
+        self.record_indices = {
+            glyph_order[name_index]: i
+            for i, name_index in enumerate(self.glyph_records['name_index'].tolist())
+        }
+
+    def __contains__(self, glyph_name):
+        return glyph_name in self.record_indices
+
+    def covers(self, glyph_names):
+        record_indices = self.record_indices
+        return all(glyph_name in record_indices for glyph_name in glyph_names)
+
+    def iter_glyphs(self, glyph_names=None):
+        # 批量返回(字形名称, 数据, (advance, lsb), (v_advance, tsb))
+        records = self.glyph_records
+        offsets = records['offset'].tolist()
+        lengths = records['length'].tolist()
+        advances = records['advance'].tolist()
+        lsbs = records['lsb'].tolist()
+        v_advances = records['v_advance'].tolist()
+        tsbs = records['tsb'].tolist()
+        buffer = self.buffer
+        blob_offset = self.blob_offset
+        if glyph_names is None:
+            glyph_order = self.glyph_order
+            glyph_names = [glyph_order[name_index] for name_index in records['name_index'].tolist()]
+        for glyph_name in glyph_names:
+            i = self.record_indices[glyph_name]
+            start = blob_offset + offsets[i]
+            yield glyph_name, buffer[start:start + lengths[i]], (advances[i], lsbs[i]), (v_advances[i], tsbs[i])
+
+    def get_component_names(self, glyph_name):
+        # 返回缓存中复合字形引用的组件名称，未缓存的字形返回空列表
+        i = self.record_indices.get(glyph_name)
+        if i is None:
+            return []
+        start = self.blob_offset + int(self.glyph_records['offset'][i])
+        data = self.buffer[start:start + int(self.glyph_records['length'][i])]
+        if is_composite_data(data):
+            glyph_order = self.glyph_order
+            return [glyph_order[gid] for gid in get_component_gids(data)]
+        return []
+
+    def get_cmap(self):
+        glyph_order = self.glyph_order
+        return {
+            code: glyph_order[name_index]
+            for code, name_index in zip(self.cmap_records['code'].tolist(), self.cmap_records['name_index'].tolist())
+        }
+
+    def close(self):
+        # 先释放NumPy数组对mmap的引用，再关闭mmap
+        self.glyph_records = None
+        self.cmap_records = None
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.buffer = None
+        if self.file is not None:
+            self.file.close()
+
+class GlyphSubsetCache:
+    # 字形子集缓存目录，超过大小上限时按最近使用时间淘汰
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.layout_hits = 0
+        self.layout_misses = 0
+        self.instance_hits = 0
+        self.instance_misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            subset = GlyphSubset(path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"警告: 字形缓存文件无效，已删除: {path}: {str(e)}")
+            self.remove(path)
+            return None
+        # 更新访问时间，供淘汰时判断
+        os.utime(path)
+        return subset
+
+    def lookup(self, key, select_glyphs):
+        # 返回缓存条目和其中需要导入的字形名称，缓存不完整或不存在时返回(None, None)
+        # select_glyphs(缓存条目)返回需要导入的字形名称
+        subset = self.load(key)
+        if subset is not None:
+            glyph_names = select_glyphs(subset)
+            if subset.covers(glyph_names):
+                self.hits += 1
+                return subset, glyph_names
+            subset.close()
+        self.misses += 1
+        return None, None
+
+    def store(self, key, glyph_order, glyphs, cmap, has_vmtx):
+        # 写入缓存条目，已有条目中的其他字形会一并保留
+        existing = self.load(key)
+        if existing is not None:
+            try:
+                if existing.glyph_order == glyph_order and existing.has_vmtx == has_vmtx:
+                    new_names = {glyph[0] for glyph in glyphs}
+                    glyphs = list(glyphs) + [
+                        (glyph_name, bytes(data), metrics, vertical_metrics)
+                        for glyph_name, data, metrics, vertical_metrics in existing.iter_glyphs()
+                        if glyph_name not in new_names
+                    ]
+            finally:
+                existing.close()
+
+        self.store_data(key + CACHE_SUFFIX, build_subset_data(glyph_order, glyphs, cmap, has_vmtx))
+
+    def load_layout(self, key):
+        # 返回布局表缓存数据，不存在时返回None
+        data = self.load_data(key + LAYOUT_SUFFIX)
+        if data is None:
+            self.layout_misses += 1
+        else:
+            self.layout_hits += 1
+        return data
+
+    def store_layout(self, key, data):
+        self.store_data(key + LAYOUT_SUFFIX, data)
+
+    def load_instance(self, key):
+        # 返回实例化后的字体数据，不存在时返回None
+        data = self.load_data(key + INSTANCE_SUFFIX)
+        if data is None:
+            self.instance_misses += 1
+        else:
+            self.instance_hits += 1
+        return data
+
+    def store_instance(self, key, data):
+        self.store_data(key + INSTANCE_SUFFIX, data)
+
+    def load_data(self, file_name):
+        path = os.path.join(self.cache_dir, file_name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        os.utime(path)
+        return data
+
+    def store_data(self, file_name, data):
+        # 缓存文件可以随时重新生成，不需要在替换前刷新到磁盘
+        write_file_atomic(os.path.join(self.cache_dir, file_name), data, sync=False)
+        self.evict()
+
+    def evict(self):
+        # 按最近使用时间从旧到新删除缓存文件，直到总大小不超过上限
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith((CACHE_SUFFIX, LAYOUT_SUFFIX, INSTANCE_SUFFIX)):
+                path = os.path.join(self.cache_dir, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total_size <= self.max_bytes:
+                break
+            self.remove(path)
+            total_size -= size
+            self.evictions += 1
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'layout_hits': self.layout_hits,
+            'layout_misses': self.layout_misses,
+            'instance_hits': self.instance_hits,
+            'instance_misses': self.instance_misses,
+        }
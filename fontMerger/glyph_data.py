@@ -0,0 +1,63 @@
+import struct
+from fontTools.ttLib.tables._g_l_y_f import (
+    ARG_1_AND_2_ARE_WORDS, WE_HAVE_A_SCALE, MORE_COMPONENTS,
+    WE_HAVE_AN_X_AND_Y_SCALE, WE_HAVE_A_TWO_BY_TWO
+)
+
+# 直接处理编译后的glyf字形数据，不需要把字形解码为Python对象
+
+# 字形头: numberOfContours, xMin, yMin, xMax, yMax
+GLYPH_HEADER_SIZE = 10
+
+def is_composite_data(data):
+    # numberOfContours为负数表示复合字形
+    return len(data) >= GLYPH_HEADER_SIZE and struct.unpack_from('>h', data, 0)[0] < 0
+
+def iter_component_gid_offsets(data):
+    # 逐个返回复合字形中组件glyphIndex字段的字节偏移
+    pos = GLYPH_HEADER_SIZE
+    more = True
+    while more:
+        flags = struct.unpack_from('>H', data, pos)[0]
+        yield pos + 2
+        pos += 4
+        pos += 4 if flags & ARG_1_AND_2_ARE_WORDS else 2
+        if flags & WE_HAVE_A_SCALE:
+            pos += 2
+        elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+            pos += 4
+        elif flags & WE_HAVE_A_TWO_BY_TWO:
+            pos += 8
+        more = flags & MORE_COMPONENTS
+
+def get_component_gids(data):
+    return [struct.unpack_from('>H', data, offset)[0] for offset in iter_component_gid_offsets(data)]
+
+def remap_component_gids(data, gid_map):
+    # 按gid_map(旧GID -> 新GID)改写复合字形中的组件GID，返回新的字形数据
+    new_data = bytearray(data)
+    for offset in iter_component_gid_offsets(data):
+        old_gid = struct.unpack_from('>H', data, offset)[0]
+        struct.pack_into('>H', new_data, offset, gid_map(old_gid))
+    return bytes(new_data)
+
+def get_glyph_data(glyf_table, glyph_name):
+    # 返回字形编译后的数据：未解码的字形直接返回从glyf表读取的原始字节，不会触发解码
+    # 复合字形中的组件GID为该字形所在字体中的GID
+    glyph = glyf_table.glyphs[glyph_name]
+    data = getattr(glyph, 'data', None)
+    if data is None:
+        data = glyph.compile(glyf_table)
+    return data
+
+def get_component_names(glyf_table, glyph_name, glyph_order):
+    # 返回复合字形引用的组件名称，简单字形或不存在的字形返回空列表，不会触发解码
+    glyph = glyf_table.glyphs.get(glyph_name)
+    if glyph is None:
+        return []
+    data = getattr(glyph, 'data', None)
+    if data is None:
+        return [component.glyphName for component in glyph.components] if glyph.isComposite() else []
+    if is_composite_data(data):
+        return [glyph_order[gid] for gid in get_component_gids(data)]
+    return []
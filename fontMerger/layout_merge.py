@@ -0,0 +1,386 @@
+import json
+import struct
+import hashlib
+import fontTools.subset  # 注册布局表的closure_glyphs、subset_glyphs等方法
+import fontTools.merge.layout  # 注册mapLookups、mapFeatures等方法
+from fontTools.ttLib import TTFont, newTable
+from fontTools.ttLib.scaleUpem import ScalerVisitor
+from fontTools.ttLib.tables import otTables
+
+# 合并OpenType布局表：把源字体的GSUB、GPOS、GDEF和kern按导入结果重映射到输出中的字形名称，
+# 删除引用未导入字形的规则，再追加到基础字体的对应表中
+
+# 按处理顺序排列：GDEF需要先合并，GSUB和GPOS的查找标志依赖合并后的标记类别
+LAYOUT_TABLE_TAGS = ('GDEF', 'GSUB', 'GPOS', 'kern')
+# 源字体中未导入的字形在重映射时使用的名称前缀，不会与有效的字形名称冲突
+DROPPED_GLYPH_PREFIX = '\0'
+# 文字的脚本在字体中不存在时依次尝试的脚本（与HarfBuzz一致）
+SCRIPT_FALLBACK_TAGS = ('DFLT', 'dflt', 'latn')
+NO_REQUIRED_FEATURE = 0xFFFF
+
+# 查找标志中的标记过滤集合标志和标记附着类别
+LOOKUP_FLAG_USE_MARK_FILTERING_SET = 0x0010
+LOOKUP_FLAG_MARK_ATTACHMENT_TYPE = 0xFF00
+
+# 布局表缓存数据：魔数、版本、JSON头长度，JSON头之后依次为各表的编译数据
+LAYOUT_CACHE_MAGIC = b'HFLT'
+LAYOUT_CACHE_VERSION = 1
+LAYOUT_HEADER_FORMAT = '>4sHI'
+LAYOUT_HEADER_SIZE = struct.calcsize(LAYOUT_HEADER_FORMAT)
+
+class LayoutGlyphs:
+    # 传给fontTools子集化方法的字形集合，只提供布局表需要的属性
+    def __init__(self, glyphs):
+        self.glyphs = set(glyphs)
+        self.glyphs_gsubed = frozenset(self.glyphs)
+
+def make_glyph_order_font(glyph_order):
+    # 只有字形顺序的空字体，用于按GID解析或编译布局表
+    font = TTFont()
+    font.setGlyphOrder(list(glyph_order))
+    return font
+
+def get_gsub_closure(font, glyph_names):
+    # 返回glyph_names以及通过GSUB替换（连字、变体等）可以得到的所有字形，与fontTools子集化的闭包相同
+    # 单独解析一份GSUB，不修改字体中（可能被多个任务共享）的表
+    glyphs = LayoutGlyphs(glyph_names)
+    if 'GSUB' not in font:
+        return glyphs.glyphs
+    gsub = newTable('GSUB')
+    gsub.decompile(font.getTableData('GSUB'), font)
+    gsub.closure_glyphs(glyphs)
+    return glyphs.glyphs.intersection(font.getGlyphOrder())
+
+def extract_layout_tables(font, glyph_map, scale_factor=1.0):
+    # 返回{表标签: 表对象}：字形名称已改为输出中的名称，只保留引用导入字形的规则，度量按比例缩放
+    # glyph_map为源字形名称到输出字形名称的映射，不在映射中的字形视为未导入
+    glyph_order = font.getGlyphOrder()
+    remap_font = make_glyph_order_font([
+        glyph_map.get(glyph_name) or f"{DROPPED_GLYPH_PREFIX}{gid}" for gid, glyph_name in enumerate(glyph_order)
+    ])
+    glyphs = LayoutGlyphs(glyph_map.values())
+    tables = {}
+    for tag in LAYOUT_TABLE_TAGS:
+        if tag not in font:
+            continue
+        table = newTable(tag)
+        table.decompile(font.getTableData(tag), remap_font)
+        if tag == 'kern':
+            subset_kern_table(table, glyphs.glyphs)
+        elif tag == 'GDEF':
+            subset_gdef_table(table, glyphs)
+        else:
+            table.subset_glyphs(glyphs)
+            # 条件特性变体只用于可变字体
+            table.table.FeatureVariations = None
+            table.table.Version = 0x00010000
+        if is_empty_layout_table(table):
+            continue
+        if scale_factor != 1.0 and tag != 'GSUB':
+            ScalerVisitor(scale_factor).visit(table)
+        tables[tag] = table
+    return tables
+
+def subset_kern_table(table, glyphs):
+    # 只保留左右字形都被导入的字偶距，无法按字形重映射的格式（非0格式）直接删除
+    subtables = []
+    for subtable in table.kernTables:
+        if getattr(subtable, 'format', None) != 0:
+            continue
+        subtable.kernTable = {
+            pair: value for pair, value in subtable.kernTable.items() if pair[0] in glyphs and pair[1] in glyphs
+        }
+        if subtable.kernTable:
+            subtables.append(subtable)
+    table.kernTables = subtables
+
+def subset_gdef_table(table, glyphs):
+    # fontTools会删除变空的标记过滤集合，这里保留空集合，查找中的集合序号保持不变
+    mark_glyph_sets = getattr(table.table, 'MarkGlyphSetsDef', None)
+    coverages = list(mark_glyph_sets.Coverage) if mark_glyph_sets else None
+    table.subset_glyphs(glyphs)
+    if mark_glyph_sets:
+        mark_glyph_sets.Coverage = coverages
+        mark_glyph_sets.MarkSetCount = len(coverages)
+
+def is_empty_layout_table(table):
+    if table.tableTag == 'kern':
+        return not table.kernTables
+    if table.tableTag == 'GDEF':
+        gdef = table.table
+        return not any((
+            gdef.GlyphClassDef and gdef.GlyphClassDef.classDefs,
+            gdef.AttachList and gdef.AttachList.GlyphCount,
+            gdef.LigCaretList and gdef.LigCaretList.LigGlyphCount,
+            gdef.MarkAttachClassDef and gdef.MarkAttachClassDef.classDefs,
+            getattr(gdef, 'MarkGlyphSetsDef', None) and any(c.glyphs for c in gdef.MarkGlyphSetsDef.Coverage),
+        ))
+    return not table.table.LookupList or not table.table.LookupList.LookupCount
+
+def merge_layout_tables(base_font, tables):
+    # 把extract_layout_tables的结果追加到基础字体，tables中的表对象会被修改
+    mark_class_offset = mark_set_offset = 0
+    if 'GDEF' in tables:
+        mark_class_offset, mark_set_offset = merge_gdef_table(base_font, tables['GDEF'])
+    for tag in ('GSUB', 'GPOS'):
+        if tag in tables:
+            shift_lookup_mark_flags(tables[tag].table, mark_class_offset, mark_set_offset)
+            merge_otl_table(base_font, tag, tables[tag])
+    if 'kern' in tables:
+        merge_kern_table(base_font, tables['kern'])
+
+def merge_gdef_table(base_font, gdef):
+    # 合并字形类别、附着点、连字插入符、标记附着类别和标记过滤集合
+    # 返回源字体的标记附着类别和标记过滤集合序号需要增加的偏移
+    if 'GDEF' not in base_font:
+        base_font['GDEF'] = gdef
+        return 0, 0
+    base_font['GDEF'].ensureDecompiled()
+    base = base_font['GDEF'].table
+    donor = gdef.table
+
+    mark_class_offset = 0
+    if base.MarkAttachClassDef and base.MarkAttachClassDef.classDefs:
+        mark_class_offset = max(base.MarkAttachClassDef.classDefs.values())
+    base_mark_sets = getattr(base, 'MarkGlyphSetsDef', None)
+    mark_set_offset = len(base_mark_sets.Coverage) if base_mark_sets else 0
+
+    for attr in ('GlyphClassDef', 'MarkAttachClassDef'):
+        donor_class_def = getattr(donor, attr)
+        if not donor_class_def or not donor_class_def.classDefs:
+            continue
+        offset = mark_class_offset if attr == 'MarkAttachClassDef' else 0
+        if getattr(base, attr) is None:
+            setattr(base, attr, otTables.ClassDef())
+            getattr(base, attr).classDefs = {}
+        base_class_defs = getattr(base, attr).classDefs
+        for glyph_name, glyph_class in donor_class_def.classDefs.items():
+            base_class_defs[glyph_name] = glyph_class + offset
+
+    # 导入的字形排在基础字体的字形之后，直接追加后覆盖表仍按GID排序
+    for attr, count_attr, items_attr in (('AttachList', 'GlyphCount', 'AttachPoint'),
+                                         ('LigCaretList', 'LigGlyphCount', 'LigGlyph')):
+        donor_list = getattr(donor, attr)
+        if not donor_list or not getattr(donor_list, count_attr):
+            continue
+        base_list = getattr(base, attr)
+        if base_list is None:
+            setattr(base, attr, donor_list)
+            continue
+        base_list.Coverage.glyphs.extend(donor_list.Coverage.glyphs)
+        getattr(base_list, items_attr).extend(getattr(donor_list, items_attr))
+        setattr(base_list, count_attr, len(getattr(base_list, items_attr)))
+
+    donor_mark_sets = getattr(donor, 'MarkGlyphSetsDef', None)
+    if donor_mark_sets and donor_mark_sets.Coverage:
+        if not base_mark_sets:
+            base_mark_sets = base.MarkGlyphSetsDef = otTables.MarkGlyphSetsDef()
+            base_mark_sets.MarkSetTableFormat = 1
+            base_mark_sets.Coverage = []
+        base_mark_sets.Coverage.extend(donor_mark_sets.Coverage)
+        base_mark_sets.MarkSetCount = len(base_mark_sets.Coverage)
+        base.Version = max(base.Version, 0x00010002)
+    return mark_class_offset, mark_set_offset
+
+def shift_lookup_mark_flags(table, mark_class_offset, mark_set_offset):
+    # 按合并后的GDEF调整源字体查找使用的标记附着类别和标记过滤集合序号
+    for lookup in table.LookupList.Lookup:
+        mark_class = (lookup.LookupFlag & LOOKUP_FLAG_MARK_ATTACHMENT_TYPE) >> 8
+        if mark_class and mark_class_offset:
+            if mark_class + mark_class_offset > 0xFF:
+                print("警告: 标记附着类别超过255个，部分查找将不再限定标记类别")
+                lookup.LookupFlag &= ~LOOKUP_FLAG_MARK_ATTACHMENT_TYPE
+            else:
+                lookup.LookupFlag = (
+                    lookup.LookupFlag & ~LOOKUP_FLAG_MARK_ATTACHMENT_TYPE | (mark_class + mark_class_offset) << 8
+                )
+        if lookup.LookupFlag & LOOKUP_FLAG_USE_MARK_FILTERING_SET:
+            lookup.MarkFilteringSet += mark_set_offset
+
+def merge_otl_table(base_font, tag, donor_table):
+    # 追加源字体的查找和特性，并按脚本和语言合并特性列表
+    if tag not in base_font:
+        base_font[tag] = donor_table
+        return
+    base_table = base_font[tag]
+    base_table.ensureDecompiled()
+    base = base_table.table
+    donor = donor_table.table
+    for attr, list_class, items_attr, count_attr in (('ScriptList', otTables.ScriptList, 'ScriptRecord', 'ScriptCount'),
+                                                     ('FeatureList', otTables.FeatureList, 'FeatureRecord', 'FeatureCount'),
+                                                     ('LookupList', otTables.LookupList, 'Lookup', 'LookupCount')):
+        if getattr(base, attr) is None:
+            new_list = list_class()
+            setattr(new_list, items_attr, [])
+            setattr(new_list, count_attr, 0)
+            setattr(base, attr, new_list)
+
+    lookup_offset = len(base.LookupList.Lookup)
+    feature_offset = len(base.FeatureList.FeatureRecord)
+    lookup_map = range(lookup_offset, lookup_offset + len(donor.LookupList.Lookup))
+    donor.LookupList.mapLookups(lookup_map)
+    if donor.FeatureList:
+        donor.FeatureList.mapLookups(lookup_map)
+        feature_map = range(feature_offset, feature_offset + len(donor.FeatureList.FeatureRecord))
+        if donor.ScriptList:
+            donor.ScriptList.mapFeatures(feature_map)
+        base.FeatureList.FeatureRecord.extend(donor.FeatureList.FeatureRecord)
+        base.FeatureList.FeatureCount = len(base.FeatureList.FeatureRecord)
+    base.LookupList.Lookup.extend(donor.LookupList.Lookup)
+    base.LookupList.LookupCount = len(base.LookupList.Lookup)
+    if donor.ScriptList:
+        merge_script_lists(base.ScriptList, donor.ScriptList, base.FeatureList)
+
+def get_lang_sys(scripts, script_tag, lang_tag=None):
+    # 按文字排版时的回退规则返回脚本和语言实际使用的LangSys，都不存在时返回None
+    script = scripts.get(script_tag)
+    if script is None:
+        script = next((scripts[tag] for tag in SCRIPT_FALLBACK_TAGS if tag in scripts), None)
+    if script is None:
+        return None
+    if lang_tag is not None:
+        for record in script.LangSysRecord:
+            if record.LangSysTag == lang_tag:
+                return record.LangSys
+    return script.DefaultLangSys
+
+def merge_lang_sys(base_lang_sys, donor_lang_sys, feature_list, combined_features):
+    # 合并两个LangSys的特性序号，必需特性优先使用基础字体的
+    if base_lang_sys is None and donor_lang_sys is None:
+        return None
+    lang_sys = otTables.LangSys()
+    lang_sys.LookupOrder = None
+    lang_sys.ReqFeatureIndex = NO_REQUIRED_FEATURE
+    feature_indices = []
+    for source in (base_lang_sys, donor_lang_sys):
+        if source is None:
+            feature_indices.append(set())
+            continue
+        feature_indices.append(set(source.FeatureIndex))
+        if source.ReqFeatureIndex != NO_REQUIRED_FEATURE:
+            if lang_sys.ReqFeatureIndex == NO_REQUIRED_FEATURE:
+                lang_sys.ReqFeatureIndex = source.ReqFeatureIndex
+            else:
+                feature_indices[-1].add(source.ReqFeatureIndex)
+    lang_sys.FeatureIndex = combine_features(*feature_indices, feature_list, combined_features)
+    lang_sys.FeatureCount = len(lang_sys.FeatureIndex)
+    return lang_sys
+
+def combine_features(base_indices, donor_indices, feature_list, combined_features):
+    # 同一LangSys中相同标签的特性只有第一个会被文字排版引擎使用（例如两个字体各自的kern），
+    # 两个字体都有的特性合并为一个包含双方所有查找的新特性，combined_features缓存已合并的特性
+    records = feature_list.FeatureRecord
+    base_tags = {}
+    for index in sorted(base_indices):
+        base_tags.setdefault(records[index].FeatureTag, []).append(index)
+    donor_tags = {}
+    for index in sorted(donor_indices):
+        donor_tags.setdefault(records[index].FeatureTag, []).append(index)
+    result = set(base_indices) | set(donor_indices)
+    for tag in sorted(base_tags.keys() & donor_tags.keys()):
+        indices = tuple(base_tags[tag] + donor_tags[tag])
+        if indices not in combined_features:
+            feature = otTables.Feature()
+            feature.FeatureParams = records[indices[0]].Feature.FeatureParams
+            feature.LookupListIndex = sorted({
+                lookup_index for index in indices for lookup_index in records[index].Feature.LookupListIndex
+            })
+            feature.LookupCount = len(feature.LookupListIndex)
+            record = otTables.FeatureRecord()
+            record.FeatureTag = tag
+            record.Feature = feature
+            records.append(record)
+            feature_list.FeatureCount = len(records)
+            combined_features[indices] = len(records) - 1
+        result.difference_update(indices)
+        result.add(combined_features[indices])
+    return sorted(result)
+
+def merge_script_lists(base_list, donor_list, feature_list):
+    # 重建脚本列表：每个脚本和语言的特性为两个字体在该脚本和语言下（按回退规则）实际使用的特性之和
+    # 这样新增的脚本或语言不会让基础字体原来通过回退生效的特性失效
+    combined_features = {}
+    base_scripts = {record.ScriptTag: record.Script for record in base_list.ScriptRecord}
+    donor_scripts = {record.ScriptTag: record.Script for record in donor_list.ScriptRecord}
+    records = []
+    for script_tag in sorted(set(base_scripts) | set(donor_scripts)):
+        lang_tags = sorted({
+            lang_record.LangSysTag
+            for scripts in (base_scripts, donor_scripts) if script_tag in scripts
+            for lang_record in scripts[script_tag].LangSysRecord
+        })
+        script = otTables.Script()
+        script.DefaultLangSys = merge_lang_sys(
+            get_lang_sys(base_scripts, script_tag), get_lang_sys(donor_scripts, script_tag),
+            feature_list, combined_features
+        )
+        script.LangSysRecord = []
+        for lang_tag in lang_tags:
+            lang_record = otTables.LangSysRecord()
+            lang_record.LangSysTag = lang_tag
+            lang_record.LangSys = merge_lang_sys(
+                get_lang_sys(base_scripts, script_tag, lang_tag), get_lang_sys(donor_scripts, script_tag, lang_tag),
+                feature_list, combined_features
+            )
+            script.LangSysRecord.append(lang_record)
+        script.LangSysCount = len(script.LangSysRecord)
+        record = otTables.ScriptRecord()
+        record.ScriptTag = script_tag
+        record.Script = script
+        records.append(record)
+    base_list.ScriptRecord = records
+    base_list.ScriptCount = len(records)
+
+def merge_kern_table(base_font, kern_table):
+    # 合并格式0的字偶距子表，覆盖方式相同的子表合并为一个
+    if 'kern' not in base_font:
+        base_font['kern'] = kern_table
+        return
+    base_kern = base_font['kern']
+    if base_kern.version != kern_table.version:
+        print("警告: 字体的kern表版本不同，未合并字偶距")
+        return
+    for subtable in kern_table.kernTables:
+        target = next((
+            base_subtable for base_subtable in base_kern.kernTables
+            if getattr(base_subtable, 'format', None) == 0 and base_subtable.coverage == subtable.coverage
+        ), None)
+        if target is None:
+            base_kern.kernTables.append(subtable)
+        else:
+            target.kernTable.update(subtable.kernTable)
+
+def make_layout_cache_key(subset_key, glyph_map):
+    # 布局表的缓存键：字形子集的缓存键加上字形映射的哈希，导入的字形或重命名不同时使用不同的条目
+    digest = hashlib.sha256()
+    for glyph_name, output_name in sorted(glyph_map.items()):
+        digest.update(f"{glyph_name}\t{output_name}\n".encode('utf-8'))
+    return f"{subset_key}-{digest.hexdigest()[:16]}"
+
+def pack_layout_tables(tables, glyph_names):
+    # 把extract_layout_tables的结果编译为缓存数据，glyph_names为按输出GID排序的导入字形名称
+    font = make_glyph_order_font(glyph_names)
+    entries = []
+    chunks = []
+    for tag, table in tables.items():
+        data = table.compile(font)
+        entries.append([tag, len(data)])
+        chunks.append(data)
+    header = json.dumps({'glyph_order': glyph_names, 'tables': entries}, ensure_ascii=False).encode('utf-8')
+    return struct.pack(LAYOUT_HEADER_FORMAT, LAYOUT_CACHE_MAGIC, LAYOUT_CACHE_VERSION, len(header)) + header + b''.join(chunks)
+
+def unpack_layout_tables(data):
+    # pack_layout_tables的逆过程，数据无效时抛出ValueError
+    magic, version, header_size = struct.unpack_from(LAYOUT_HEADER_FORMAT, data, 0)
+    if magic != LAYOUT_CACHE_MAGIC or version != LAYOUT_CACHE_VERSION:
+        raise ValueError("布局表缓存格式不匹配")
+    header = json.loads(data[LAYOUT_HEADER_SIZE:LAYOUT_HEADER_SIZE + header_size].decode('utf-8'))
+    font = make_glyph_order_font(header['glyph_order'])
+    offset = LAYOUT_HEADER_SIZE + header_size
+    tables = {}
+    for tag, length in header['tables']:
+        table = newTable(tag)
+        table.decompile(data[offset:offset + length], font)
+        tables[tag] = table
+        offset += length
+    return tables
@@ -0,0 +1,1523 @@
+import os
+import io
+import copy
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fontTools.ttLib import TTFont, newTable
+from fontTools.ttLib.tables._c_m_a_p import CmapSubtable
+from fontTools.ttLib.tables._g_l_y_f import Glyph
+from fontTools.ttLib.tables.O_S_2f_2 import intersectUnicodeRanges
+from atomic_file import open_atomic, write_file_atomic
+from source_cache import PreparedSource, hash_font_data
+from font_instance import InstanceCache, resolve_location, make_instance_key, instantiate_font_data
+from glyph_cache import GlyphSubset, make_cache_key, build_subset_data
+from glyph_data import is_composite_data, remap_component_gids, get_glyph_data, get_component_names
+from glyf_stream import GlyphSpill, write_font_streamed, update_glyf_stats
+from layout_merge import (
+    LAYOUT_TABLE_TAGS, get_gsub_closure, extract_layout_tables, merge_layout_tables, make_layout_cache_key,
+    pack_layout_tables, unpack_layout_tables
+)
+from build_manifest import BuildManifest, get_manifest_path, hash_file
+from codepoint_set import load_codepoint_set
+from outline_convert import (
+    is_cff_font, get_cu2qu_max_err, convert_to_glyf_glyph, convert_to_charstring, add_charstring,
+    get_charstring_xmin
+)
+from merge_profile import MergeProfile
+from web_font import get_output_flavor, get_web_output_path, compress_font_data, check_web_format
+
+class FontMergeError(Exception):
+    # 合并失败时抛出，消息可以直接展示给用户
+    pass
+
+class GlyphIndex:
+    # 合并会话的字形索引：名称集合 + 名称到GID的映射
+    # 整个合并过程只构建一次，追加字形时增量维护，避免在glyphOrder列表上做线性查找
+    def __init__(self, font):
+        self.glyph_order = font.getGlyphOrder()
+        # 直接复用TTFont的反向字形映射，保证字体对象内的名称到GID映射始终同步
+        self.gid_map = font.getReverseGlyphMap(rebuild=True)
+        # 当前合并字体新增的字形名称（按追加顺序）以及对应的源字形名称
+        self.added = []
+        self.added_sources = []
+        # 当前合并字体的字形重命名表：与已有字形同名的源字形名称到新名称的映射
+        self.renames = {}
+        # 当前合并字体已导入的源字形名称到输出字形名称的映射
+        self.source_map = {}
+
+    def __contains__(self, glyph_name):
+        return glyph_name in self.gid_map
+
+    def __len__(self):
+        return len(self.glyph_order)
+
+    def get_gid(self, glyph_name):
+        return self.gid_map.get(glyph_name)
+
+    def begin_source(self, source_names=()):
+        # 开始合并新的字体时清空新增记录，并一次性为与已有字形同名的源字形分配新名称
+        self.added = []
+        self.added_sources = []
+        self.source_map = {}
+        self.renames = {}
+        reserved = set(source_names)
+        for glyph_name in source_names:
+            if glyph_name in self.gid_map:
+                new_name = self.make_unique_name(glyph_name, reserved)
+                reserved.add(new_name)
+                self.renames[glyph_name] = new_name
+
+    def make_unique_name(self, glyph_name, reserved):
+        # 追加.1、.2等后缀：#不是PostScript字形名称允许的字符，CFF的charset和post表（格式2）中不能使用
+        n = 1
+        while f"{glyph_name}.{n}" in self.gid_map or f"{glyph_name}.{n}" in reserved:
+            n += 1
+        return f"{glyph_name}.{n}"
+
+    def get_output_name(self, source_name):
+        # 源字形在输出中使用的名称
+        return self.renames.get(source_name, source_name)
+
+    def add(self, source_name):
+        # 按重命名表追加字形名称并返回新的GID
+        glyph_name = self.renames.get(source_name, source_name)
+        gid = len(self.glyph_order)
+        self.glyph_order.append(glyph_name)
+        self.gid_map[glyph_name] = gid
+        self.added.append(glyph_name)
+        self.added_sources.append(source_name)
+        self.source_map[source_name] = glyph_name
+        return gid
+
+# 可以写入BMP码位的cmap子表格式，以及可以写入完整Unicode码位的子表格式
+CMAP_BMP_FORMATS = (4, 6)
+CMAP_FULL_FORMATS = (12,)
+
+def get_unicode_subtables(cmap_table):
+    # 返回去重后的Unicode cmap子表，完整范围的子表（format 12）排在前面
+    # fontTools会让偏移相同的子表共享同一个映射字典，内容相同的子表也只保留一个
+    subtables = []
+    seen_ids = set()
+    for table in cmap_table.tables:
+        if not table.isUnicode() or table.format not in CMAP_BMP_FORMATS + CMAP_FULL_FORMATS:
+            continue
+        if id(table.cmap) in seen_ids:
+            continue
+        seen_ids.add(id(table.cmap))
+        if any(len(other.cmap) == len(table.cmap) and other.cmap == table.cmap for other in subtables):
+            continue
+        subtables.append(table)
+    subtables.sort(key=lambda table: table.format not in CMAP_FULL_FORMATS)
+    return subtables
+
+def get_unicode_mapping(cmap_table):
+    # 把所有Unicode子表合并为一个码位到字形名称的映射，完整范围的子表优先
+    mapping = {}
+    for table in get_unicode_subtables(cmap_table):
+        for code, glyph_name in table.cmap.items():
+            mapping.setdefault(code, glyph_name)
+    return mapping
+
+def new_cmap_subtable(format, platform_id, plat_enc_id, mapping):
+    table = CmapSubtable.newSubtable(format)
+    table.platformID = platform_id
+    table.platEncID = plat_enc_id
+    table.language = 0
+    table.cmap = dict(mapping)
+    return table
+
+class CodepointIndex:
+    # 合并会话的码位覆盖索引：把基础字体所有Unicode子表统一为一个码位到字形名称的映射
+    # 整个合并过程只构建一次，码位查询为O(1)，新增映射时增量维护
+    def __init__(self, font):
+        self.mapping = get_unicode_mapping(font['cmap']) if 'cmap' in font else {}
+
+    def __contains__(self, code):
+        return code in self.mapping
+
+    def __len__(self):
+        return len(self.mapping)
+
+    def get(self, code):
+        return self.mapping.get(code)
+
+    def update(self, mappings):
+        self.mapping.update(mappings)
+
+# 码位冲突策略：override为后面的字体覆盖前面字体中相同码位的字形（与界面说明一致），keep为保留先合并的字形
+CONFLICT_OVERRIDE = 'override'
+CONFLICT_KEEP = 'keep'
+CONFLICT_POLICIES = (CONFLICT_OVERRIDE, CONFLICT_KEEP)
+
+# 解析时依赖字形数量的表
+GLYPH_COUNT_TABLES = ('maxp', 'head', 'loca', 'glyf', 'hhea', 'hmtx', 'vhea', 'vmtx', 'post')
+
+# 合并源字体占用的进度范围（0到MERGE_PROGRESS_END），其余为编译和保存
+MERGE_PROGRESS_END = 90
+# 合并字形时每处理这么多个字形报告一次进度
+GLYPH_PROGRESS_BATCH = 1024
+
+# 低内存模式下估算字形展开后占用的内存：glyf字形的Python对象约占800字节，另加编译后数据的5倍
+# 转换的CFF字形按固定大小估算
+EXPANDED_GLYPH_OVERHEAD = 800
+EXPANDED_GLYPH_FACTOR = 5
+EXPANDED_GLYPH_ESTIMATE = 2048
+
+def get_reachable_glyphs(glyph_order, glyph_names, get_components):
+    # 按glyph_order返回glyph_names及其复合字形（递归）引用的组件
+    reachable = set()
+    pending = list(glyph_names)
+    while pending:
+        glyph_name = pending.pop()
+        if glyph_name in reachable:
+            continue
+        reachable.add(glyph_name)
+        pending.extend(get_components(glyph_name))
+    return [glyph_name for glyph_name in glyph_order if glyph_name in reachable]
+
+def prepare_source_slice(font_path, target_height, base_units_per_em, codepoints=None, instance=None):
+    # 在工作进程中预处理一个源字体：解析、缩放（CFF字形转换为glyf字形），提取字形、度量和cmap
+    # 返回与磁盘字形缓存格式相同的紧凑数据，由主进程按源字体顺序拼接
+    # 导入哪些字形取决于前面合并的字体，这里提取所有可能被导入的字形
+    # instance为主进程中实例化好的(字体数据, 实例键)，源字体不需要实例化时为空
+    engine = FontMergeEngine([font_path], font_path)
+    if instance is not None:
+        merge_source = PreparedSource.from_data(instance[0], instance[1])
+        engine.apply_target_height(merge_source, target_height)
+    else:
+        merge_source = engine.open_merge_source(font_path, target_height)
+    merge_font = merge_source.font
+    try:
+        glyph_order = merge_font.getGlyphOrder()
+        cmap = get_unicode_mapping(merge_font['cmap'])
+        convert_outlines = 'glyf' not in merge_font
+        if convert_outlines:
+            get_components = lambda glyph_name: ()
+        else:
+            merge_glyf = merge_font['glyf']
+            get_components = lambda glyph_name: get_component_names(merge_glyf, glyph_name, glyph_order)
+        if codepoints is None:
+            glyph_names = glyph_order
+        else:
+            glyph_names = get_reachable_glyphs(
+                glyph_order,
+                get_gsub_closure(merge_font, [glyph_name for code, glyph_name in cmap.items() if code in codepoints]),
+                get_components
+            )
+        
+        if merge_source.scale_factor != 1.0:
+            engine.scale_merge_source(merge_source, [] if convert_outlines else glyph_names)
+        if convert_outlines:
+            glyphs = engine.extract_converted_glyphs(merge_font, glyph_names, base_units_per_em, merge_source.scale_factor)
+        else:
+            glyphs = engine.extract_glyphs(merge_font, glyph_names)
+        return build_subset_data(glyph_order, glyphs, cmap, 'vmtx' in merge_font)
+    finally:
+        merge_font.close()
+
+class FontMergeEngine:
+    # 不依赖Qt的字体合并逻辑，供界面线程和命令行共同使用
+    def __init__(self, font_paths, output_path, font_scale_config=None, final_font_config=None, progress_callback=None,
+                 source_cache=None, glyph_cache=None, incremental=False, font_subset_config=None, web_formats=None,
+                 stage_callback=None, conflict_policy=CONFLICT_OVERRIDE, prepare_workers=0, memory_budget=None,
+                 font_instance_config=None, instance_cache=None):
+        if conflict_policy not in CONFLICT_POLICIES:
+            raise ValueError(f"不支持的码位冲突策略: {conflict_policy}")
+        self.font_paths = font_paths
+        self.output_path = output_path
+        self.font_scale_config = font_scale_config or {}
+        self.final_font_config = final_font_config or {}
+        self.progress_callback = progress_callback
+        # 批量运行时在多个任务之间共享的合并源缓存（SourceCache），为空时不缓存
+        self.source_cache = source_cache
+        # 磁盘上的字形子集缓存（GlyphSubsetCache），为空时不使用
+        self.glyph_cache = glyph_cache
+        # 增量构建：在输出旁记录构建清单，重新构建时跳过未变化的输出或只重新合并变化的源字体
+        self.incremental = incremental
+        # 本次运行复用上次输出的源字体数量，跳过整个合并时为全部源字体数量
+        self.reused_sources = 0
+        self.up_to_date = False
+        # 按字体文件名配置的子集码位（见codepoint_set.py），只导入这些码位可以到达的字形
+        self.font_subset_config = font_subset_config or {}
+        self.source_codepoints = {}
+        # 在输出旁额外写入的网页字体格式（'woff'、'woff2'）
+        # 输出路径本身以.woff或.woff2结尾时，输出文件直接写入压缩格式
+        self.web_formats = list(web_formats or [])
+        # 每个压缩文件的(路径, 压缩前字节数, 压缩后字节数, 耗时)
+        self.web_outputs = []
+        # 分阶段的耗时、峰值内存和各源字体的导入数量，stage_callback(阶段, 源字体)在进入每个阶段时调用
+        self.profile = MergeProfile(stage_callback)
+        # 当前源字体占用的进度范围
+        self.source_progress = (0, MERGE_PROGRESS_END)
+        # 多个字体映射了同一码位时的处理方式
+        self.conflict_policy = conflict_policy
+        # 当前源字体覆盖的码位及其原来映射的字形名称，增量构建时用于恢复
+        self.cmap_overrides = {}
+        # 在进程池中并行预处理源字体的进程数，小于2时在当前线程中依次处理
+        self.prepare_workers = prepare_workers or 0
+        # 低内存模式的内存预算（字节），为空时按普通模式合并
+        # 启用时每批缩放或转换的字形不超过预算，合并后的字形数据暂存到临时文件，保存时流式写出glyf表
+        self.memory_budget = memory_budget
+        self.glyph_spill = None
+        # 当前源字体是否合并了布局表（GSUB、GPOS、GDEF、kern）
+        self.layout_merged = False
+        # 当前源字体是否向name表添加了名称记录
+        self.names_merged = False
+        # 按字体文件名配置的可变字体轴坐标（轴标签到坐标的映射），合并前实例化为静态字体
+        self.font_instance_config = font_instance_config or {}
+        # 实例化后的字体数据缓存（InstanceCache），批量运行时在多个任务之间共享
+        self.instance_cache = instance_cache if instance_cache is not None else InstanceCache()
+    
+    def report_progress(self, value):
+        if self.progress_callback is not None:
+            self.progress_callback(value)
+    
+    def report_glyph_progress(self, done, total):
+        # 按当前源字体中已处理的字形比例报告进度
+        if total and done % GLYPH_PROGRESS_BATCH == 0:
+            start, end = self.source_progress
+            self.report_progress(int(start + (end - start) * done / total))
+        
+    def run(self):
+        # 执行合并并返回输出路径，失败时抛出FontMergeError
+        try:
+            total_fonts = len(self.font_paths)
+            self.source_codepoints = self.load_source_codepoints()
+            output_flavor = get_output_flavor(self.output_path)
+            for flavor in self.web_formats + ([output_flavor] if output_flavor else []):
+                check_web_format(flavor)
+            build_manifest = None
+            resume_index = 0
+            if self.incremental:
+                build_manifest = BuildManifest.from_inputs(
+                    self.font_paths, self.font_scale_config, self.final_font_config, self.source_codepoints,
+                    self.conflict_policy, self.font_instance_config
+                )
+                previous_manifest = self.load_previous_manifest()
+                if previous_manifest is not None:
+                    if previous_manifest.is_up_to_date(build_manifest):
+                        # 输入和配置都没有变化，直接使用上次的输出
+                        self.reused_sources = total_fonts
+                        self.up_to_date = True
+                        self.profile.finish()
+                        self.report_progress(100)
+                        return self.output_path
+                    resume_index = previous_manifest.first_changed_source(build_manifest)
+                    if resume_index is None:
+                        # 只有最终字体配置变化，不需要重新合并任何源字体
+                        resume_index = total_fonts
+                    elif any(source.get('layout_merged') or source.get('names_merged')
+                             for source in previous_manifest.sources[resume_index:]):
+                        # 截断字形时无法从布局表中去掉这些源字体的查找，也无法区分它们添加的名称记录，完整重新合并
+                        resume_index = 0
+            
+            with self.profile.stage('load_base'):
+                base_font = None
+                if resume_index > 0:
+                    base_font = self.load_font(self.output_path)
+                    if 'glyf' not in base_font:
+                        # 以CFF字体为基础时不支持截断字形，完整重新合并
+                        base_font.close()
+                        base_font = None
+                
+                if base_font is not None:
+                    # 以上次的输出为基础，去掉变化的源字体及其之后导入的字形
+                    self.preload_glyph_count_tables(base_font)
+                    kept_glyph_count = previous_manifest.sources[resume_index - 1]['glyph_range'][1]
+                    self.truncate_merged_glyphs(
+                        base_font, kept_glyph_count,
+                        [source.get('cmap_overrides') or {} for source in previous_manifest.sources[resume_index:]]
+                    )
+                    for i in range(resume_index):
+                        for key in ('glyph_range', 'cmap_overrides', 'layout_merged', 'names_merged'):
+                            build_manifest.sources[i][key] = previous_manifest.sources[i].get(key)
+                    self.reused_sources = resume_index
+                else:
+                    # 加载第一个字体作为基础字体（未修改的表会以原始数据直接写入输出）
+                    base_font = self.load_source_font(self.font_paths[0])
+                    self.check_base_font(base_font)
+                    self.preload_glyph_count_tables(base_font)
+                    if build_manifest is not None:
+                        build_manifest.sources[0]['glyph_range'] = [0, len(base_font.getGlyphOrder())]
+                    resume_index = 1
+                
+                # 获取基础字体的EM大小
+                base_units_per_em = self.get_units_per_em(base_font)
+                
+                # 构建合并会话的字形索引和码位索引
+                self.glyph_index = GlyphIndex(base_font)
+                self.codepoint_index = CodepointIndex(base_font)
+                
+                if self.memory_budget is not None:
+                    if 'glyf' in base_font:
+                        # 临时文件放在输出目录中，避免系统临时目录位于内存文件系统
+                        self.glyph_spill = GlyphSpill(os.path.dirname(os.path.abspath(self.output_path)))
+                        # 源字体合并后立即释放，不放入合并源缓存
+                        self.source_cache = None
+                    else:
+                        print("警告: 以CFF字体为基础时不支持低内存模式，将按普通模式合并")
+            
+            # 多个源字体需要合并时，在进程池中并行预处理，当前线程按顺序拼接
+            executor = None
+            prepared_slices = {}
+            if self.use_parallel_prepare(base_font, total_fonts - resume_index):
+                executor = ProcessPoolExecutor(max_workers=min(self.prepare_workers, total_fonts - resume_index))
+                for i in range(resume_index, total_fonts):
+                    font_path = self.font_paths[i]
+                    # 可变字体在当前进程中实例化并缓存，工作进程直接使用实例化后的数据
+                    instance = None
+                    if self.get_instance_location(font_path) is not None:
+                        instance = self.read_source_data(font_path)
+                    prepared_slices[i] = executor.submit(
+                        prepare_source_slice, font_path, self.get_target_height(font_path, base_units_per_em),
+                        base_units_per_em, self.source_codepoints.get(os.path.basename(font_path)), instance
+                    )
+            
+            # 合并其他字体
+            try:
+                for i in range(resume_index, total_fonts):
+                    font_path = self.font_paths[i]
+                    try:
+                        # 计算进度，源字体内部按字形批次细分
+                        self.source_progress = (
+                            i / total_fonts * MERGE_PROGRESS_END, (i + 1) / total_fonts * MERGE_PROGRESS_END
+                        )
+                        self.report_progress(int(self.source_progress[0]))
+                        
+                        glyph_start = len(self.glyph_index)
+                        codepoint_start = len(self.codepoint_index)
+                        self.profile.begin_source(os.path.basename(font_path))
+                        if i in prepared_slices:
+                            self.merge_prepared_source(base_font, font_path, prepared_slices.pop(i))
+                        else:
+                            self.merge_source_font(base_font, font_path, base_units_per_em)
+                        self.profile.end_source(
+                            len(self.glyph_index) - glyph_start, len(self.codepoint_index) - codepoint_start
+                        )
+                        if build_manifest is not None:
+                            build_manifest.sources[i]['glyph_range'] = [glyph_start, len(self.glyph_index)]
+                            build_manifest.sources[i]['cmap_overrides'] = {
+                                str(code): glyph_name for code, glyph_name in self.cmap_overrides.items()
+                            }
+                            build_manifest.sources[i]['layout_merged'] = self.layout_merged
+                            build_manifest.sources[i]['names_merged'] = self.names_merged
+                        
+                    except Exception as e:
+                        raise FontMergeError(f"合并字体 '{os.path.basename(font_path)}' 时出错: {str(e)}") from e
+            finally:
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+            
+            # 设置最终字体配置
+            if self.final_font_config:
+                self.apply_final_font_config(base_font)
+            
+            # 最后检查并修复字体表的一致性，并编译为字体数据
+            self.report_progress(MERGE_PROGRESS_END)
+            streamed = False
+            with self.profile.stage('finalize'):
+                if self.glyph_spill is not None:
+                    font_data = self.write_streamed_font(base_font, output_flavor is None)
+                    streamed = font_data is None
+                else:
+                    font_data = self.finalize_font_tables(base_font)
+                base_font.close()
+            if streamed and self.web_formats:
+                # 压缩需要完整的字体数据
+                with open(self.output_path, 'rb') as f:
+                    font_data = f.read()
+            
+            # 保存合并后的字体（直接写入已编译并验证过的数据）
+            output_data = font_data
+            if output_flavor:
+                output_data = self.write_web_output(self.output_path, font_data, output_flavor)
+            elif not streamed:
+                with self.profile.stage('save'):
+                    write_file_atomic(self.output_path, font_data)
+            for flavor in self.web_formats:
+                web_path = get_web_output_path(self.output_path, flavor)
+                if web_path != self.output_path:
+                    self.write_web_output(web_path, font_data, flavor)
+            
+            # 保存构建清单
+            if build_manifest is not None:
+                if output_data is not None:
+                    build_manifest.output_hash = hash_font_data(output_data)
+                else:
+                    build_manifest.output_hash = hash_file(self.output_path)
+                write_file_atomic(get_manifest_path(self.output_path), build_manifest.to_json().encode('utf-8'))
+            
+            self.profile.finish()
+            self.report_progress(100)
+            return self.output_path
+            
+        except FontMergeError:
+            raise
+        except Exception as e:
+            raise FontMergeError(f"处理过程中出错: {str(e)}") from e
+        finally:
+            if self.glyph_spill is not None:
+                self.glyph_spill.close()
+                self.glyph_spill = None
+    
+    def merge_source_font(self, base_font, font_path, base_units_per_em):
+        # 把一个源字体合并到基础字体中
+        # 按需加载要合并的字体（启用缓存时复用已解析的字体），只有被导入的字形才会被解析
+        target_height = self.get_target_height(font_path, base_units_per_em)
+        with self.profile.stage('load'):
+            merge_source = self.open_merge_source(font_path, target_height)
+        merge_font = merge_source.font
+        if 'fvar' in merge_font:
+            print(f"警告: '{os.path.basename(font_path)}'是可变字体，只合并默认实例的轮廓，可以配置轴坐标合并其他实例")
+        
+        # 两个字体都是glyf字形时可以直接拷贝或缩放字形数据，否则按轮廓绘制转换为基础字体的格式
+        convert_outlines = 'glyf' not in base_font or 'glyf' not in merge_font
+        
+        codepoints = self.source_codepoints.get(os.path.basename(font_path))
+        self.cmap_overrides = {}
+        self.layout_merged = False
+        self.names_merged = False
+        get_substitutes = lambda glyph_names: get_gsub_closure(merge_font, glyph_names)
+        
+        # 磁盘缓存中有完整的字形子集时，直接拼接缓存的字形数据，跳过解析和缩放
+        cached_subset = None
+        use_glyph_cache = self.glyph_cache is not None and not convert_outlines
+        if use_glyph_cache:
+            subset_key = make_cache_key(merge_source.content_hash, merge_source.scale_factor)
+            with self.profile.stage('select'):
+                cached_subset, import_glyph_names = self.glyph_cache.lookup(
+                    subset_key,
+                    lambda subset: self.select_import_glyphs(
+                        subset.glyph_order, subset.get_cmap(), subset.get_component_names, codepoints, get_substitutes
+                    )
+                )
+        
+        # 重映射后的布局表缓存在磁盘字形缓存目录中
+        layout_key = None
+        if self.glyph_cache is not None and merge_source.content_hash is not None:
+            layout_key = make_cache_key(merge_source.content_hash, merge_source.scale_factor)
+        
+        if cached_subset is not None:
+            try:
+                self.merge_cached_font_data(
+                    base_font, merge_font, cached_subset, import_glyph_names, codepoints,
+                    merge_source.scale_factor, layout_key
+                )
+            finally:
+                cached_subset.close()
+        else:
+            with self.profile.stage('select'):
+                import_glyph_names = self.select_source_glyphs(merge_font, codepoints)
+            
+            # 按需缩放要导入的字形，转换轮廓或低内存模式下在合并字形时缩放，这里只缩放度量
+            if merge_source.scale_factor != 1.0:
+                with self.profile.stage('scale'):
+                    scale_glyphs = not convert_outlines and self.glyph_spill is None
+                    self.scale_merge_source(merge_source, import_glyph_names if scale_glyphs else [])
+            
+            # 合并字体数据，未缩放的字形直接拷贝原始数据
+            self.merge_font_data(
+                base_font, merge_font, import_glyph_names,
+                raw_glyphs=merge_source.scale_factor == 1.0, codepoints=codepoints,
+                outline_scale=merge_source.scale_factor if convert_outlines else None, merge_source=merge_source,
+                layout_key=layout_key
+            )
+            
+            # 把本次导入的字形写入磁盘缓存
+            if use_glyph_cache:
+                self.store_glyph_subset(subset_key, merge_font)
+        
+        # 合并完成后释放字体文件，缓存的字体留给后续任务使用
+        if self.source_cache is None:
+            merge_font.close()
+        else:
+            self.source_cache.trim()
+    
+    def use_parallel_prepare(self, base_font, source_count):
+        # 以glyf字体为基础、有多个源字体需要合并时并行预处理
+        # 启用磁盘字形缓存时缓存已经可以跳过解析和缩放，仍在当前线程中处理
+        # 低内存模式下各进程预处理的结果会同时驻留在内存中，也依次处理
+        return (
+            self.prepare_workers > 1 and source_count > 1 and 'glyf' in base_font and self.glyph_cache is None
+            and self.glyph_spill is None
+        )
+    
+    def merge_prepared_source(self, base_font, font_path, prepared_slice):
+        # 拼接在工作进程中预处理好的源字体，prepared_slice为prepare_source_slice的Future
+        with self.profile.stage('prepare'):
+            prepared_subset = GlyphSubset.from_bytes(prepared_slice.result())
+        codepoints = self.source_codepoints.get(os.path.basename(font_path))
+        self.cmap_overrides = {}
+        self.layout_merged = False
+        self.names_merged = False
+        # 合并字体只用于读取名称表和布局表等少量数据
+        merge_font = self.load_source_font(font_path)
+        try:
+            with self.profile.stage('select'):
+                import_glyph_names = [
+                    glyph_name
+                    for glyph_name in self.select_import_glyphs(
+                        prepared_subset.glyph_order, prepared_subset.get_cmap(),
+                        prepared_subset.get_component_names, codepoints,
+                        lambda glyph_names: get_gsub_closure(merge_font, glyph_names)
+                    )
+                    if glyph_name in prepared_subset
+                ]
+            # 与open_merge_source相同地计算缩放比例，用于缩放布局表中的度量
+            scale_factor = 1.0
+            target_height = self.get_target_height(font_path, self.get_units_per_em(base_font))
+            if target_height is not None and self.get_units_per_em(merge_font) != 0:
+                scale_factor = target_height / self.get_units_per_em(merge_font)
+            self.merge_cached_font_data(
+                base_font, merge_font, prepared_subset, import_glyph_names, codepoints, scale_factor
+            )
+        finally:
+            prepared_subset.close()
+            merge_font.close()
+    
+    def write_web_output(self, web_path, font_data, flavor):
+        # 压缩并写入网页字体，返回压缩后的数据
+        start_time = time.perf_counter()
+        with self.profile.stage('compress'):
+            web_data = compress_font_data(font_data, flavor)
+            write_file_atomic(web_path, web_data)
+        self.web_outputs.append((web_path, len(font_data), len(web_data), time.perf_counter() - start_time))
+        return web_data
+    
+    def check_base_font(self, base_font):
+        # 基础字体需要有glyf表或非CID的CFF表
+        if 'glyf' in base_font:
+            return
+        if not is_cff_font(base_font):
+            raise FontMergeError("基础字体既没有glyf表也没有CFF表，无法合并")
+        if hasattr(base_font['CFF '].cff.topDictIndex[0], 'FDArray'):
+            raise FontMergeError("不支持以CID字体作为基础字体")
+    
+    def load_source_codepoints(self):
+        # 读取各源字体的子集配置，返回字体文件名到码位集合的映射
+        source_codepoints = {}
+        for font_name, subset_config in self.font_subset_config.items():
+            try:
+                source_codepoints[font_name] = load_codepoint_set(subset_config)
+            except (OSError, ValueError) as e:
+                raise FontMergeError(f"字体 '{font_name}' 的子集配置无效: {str(e)}") from e
+        base_name = os.path.basename(self.font_paths[0])
+        if base_name in source_codepoints:
+            # 基础字体的布局表等按原GID引用字形，无法删减，始终完整保留
+            print(f"警告: 基础字体 '{base_name}' 不支持子集，将完整保留")
+            del source_codepoints[base_name]
+        return source_codepoints
+    
+    def load_previous_manifest(self):
+        # 读取上次构建的清单，输出文件缺失或已被修改时返回None
+        if not os.path.exists(self.output_path):
+            return None
+        previous_manifest = BuildManifest.load(get_manifest_path(self.output_path))
+        if previous_manifest is None or len(previous_manifest.sources) == 0:
+            return None
+        if previous_manifest.output_hash != hash_file(self.output_path):
+            return None
+        return previous_manifest
+    
+    def truncate_merged_glyphs(self, font, glyph_count, cmap_overrides=()):
+        # 删除GID不小于glyph_count的字形及其度量和字符映射，恢复到只合并了前面源字体时的状态
+        # cmap_overrides为被删除的各源字体（按合并顺序）覆盖的码位及其原来的字形名称
+        glyph_order = font.getGlyphOrder()
+        removed_names = set(glyph_order[glyph_count:])
+        if not removed_names and not any(cmap_overrides):
+            return
+        
+        # cmap子表会延迟解析并按当前字形顺序把GID转换为名称，必须在截断字形顺序之前清理
+        if 'cmap' in font:
+            cleaned_ids = set()
+            for table in font['cmap'].tables:
+                if not table.isUnicode() or table.format not in CMAP_BMP_FORMATS + CMAP_FULL_FORMATS \
+                        or id(table.cmap) in cleaned_ids:
+                    continue
+                cleaned_ids.add(id(table.cmap))
+                # 按合并的相反顺序恢复被覆盖的码位，原来的字形也被删除时由下面一并清理
+                for overrides in reversed(cmap_overrides):
+                    for code, glyph_name in overrides.items():
+                        code = int(code)
+                        if code <= 0xFFFF or table.format in CMAP_FULL_FORMATS:
+                            table.cmap[code] = glyph_name
+                for code in [code for code, glyph_name in table.cmap.items() if glyph_name in removed_names]:
+                    del table.cmap[code]
+        
+        del glyph_order[glyph_count:]
+        font.getReverseGlyphMap(rebuild=True)
+        
+        glyphs = font['glyf'].glyphs
+        for glyph_name in removed_names:
+            del glyphs[glyph_name]
+        for tag in ('hmtx', 'vmtx'):
+            if tag in font:
+                metrics = font[tag].metrics
+                for glyph_name in removed_names:
+                    metrics.pop(glyph_name, None)
+        
+        # post表格式2会保留已删除字形的名称，编译时需要去掉
+        post_table = font['post'] if 'post' in font else None
+        if post_table is not None and hasattr(post_table, 'extraNames'):
+            post_table.extraNames = [name for name in post_table.extraNames if name not in removed_names]
+            for glyph_name in removed_names:
+                post_table.mapping.pop(glyph_name, None)
+        
+        self.update_maxp_table(font)
+    
+    def load_font(self, font_path):
+        # 延迟加载字体：表只在首次访问时读取和解析，glyf中的字形只在访问时解码
+        return TTFont(font_path, lazy=True)
+    
+    def load_source_font(self, font_path):
+        # 加载源字体，配置了轴坐标的可变字体加载实例化后的字体
+        if self.get_instance_location(font_path) is None:
+            return self.load_font(font_path)
+        data, _ = self.read_source_data(font_path)
+        return TTFont(io.BytesIO(data), lazy=True)
+    
+    def get_instance_location(self, font_path):
+        # 返回字体配置的轴坐标，未配置时返回None
+        return self.font_instance_config.get(os.path.basename(font_path))
+    
+    def read_source_data(self, font_path):
+        # 读取源字体数据，返回(字体数据, 缓存键)
+        # 配置了轴坐标的可变字体返回实例化后的数据和实例键，依次查找内存和磁盘缓存，都未命中时实例化
+        with open(font_path, 'rb') as f:
+            data = f.read()
+        content_hash = hash_font_data(data)
+        location = self.get_instance_location(font_path)
+        if location is None:
+            return data, content_hash
+        font = TTFont(io.BytesIO(data), lazy=True)
+        try:
+            if 'fvar' not in font:
+                print(f"警告: '{os.path.basename(font_path)}'不是可变字体，忽略轴坐标配置")
+                return data, content_hash
+            location = resolve_location(font, location)
+        finally:
+            font.close()
+        
+        instance_key = make_instance_key(content_hash, location)
+        instance_data = self.instance_cache.get(instance_key)
+        if instance_data is None:
+            if self.glyph_cache is not None:
+                instance_data = self.glyph_cache.load_instance(instance_key)
+            if instance_data is None:
+                with self.profile.stage('instance'):
+                    instance_data = instantiate_font_data(data, location)
+                self.instance_cache.instantiated += 1
+                if self.glyph_cache is not None:
+                    self.glyph_cache.store_instance(instance_key, instance_data)
+            self.instance_cache.put(instance_key, instance_data)
+        return instance_data, instance_key
+    
+    def preload_glyph_count_tables(self, font):
+        # 依赖字形数量的表必须在追加字形之前解析，否则延迟解析时会按新的字形数量读取旧数据
+        for tag in GLYPH_COUNT_TABLES:
+            if tag in font:
+                font[tag]
+        # hdmx和LTSH只是按字形数量排列的缓存表，无法随合并更新，直接删除
+        for tag in ('hdmx', 'LTSH'):
+            if tag in font:
+                del font[tag]
+    
+    def get_target_height(self, font_path, base_units_per_em):
+        # 返回字体单独缩放的目标高度，未启用缩放时返回None
+        scale_config = self.font_scale_config.get(os.path.basename(font_path))
+        if scale_config and scale_config.get('enabled', False):
+            return scale_config.get('target_height', base_units_per_em)
+        return None
+    
+    def open_merge_source(self, font_path, target_height):
+        # 加载要合并的字体，并计算缩放比例
+        if self.source_cache is None and self.glyph_cache is None and self.get_instance_location(font_path) is None:
+            merge_source = PreparedSource(self.load_font(font_path), os.path.getsize(font_path))
+        else:
+            # 启用缓存时按文件内容计算缓存键，实例化的可变字体使用实例键
+            data, content_hash = self.read_source_data(font_path)
+            if self.source_cache is not None:
+                cache_key = (content_hash, target_height)
+                merge_source = self.source_cache.get(cache_key)
+                if merge_source is not None:
+                    return merge_source
+            merge_source = PreparedSource.from_data(data, content_hash)
+            if self.source_cache is not None:
+                self.source_cache.put(cache_key, merge_source)
+        
+        self.apply_target_height(merge_source, target_height)
+        return merge_source
+    
+    def apply_target_height(self, merge_source, target_height):
+        if target_height is not None:
+            current_units_per_em = self.get_units_per_em(merge_source.font)
+            if current_units_per_em != 0:
+                # 计算缩放比例
+                merge_source.scale_factor = target_height / current_units_per_em
+    
+    def scale_merge_source(self, merge_source, glyph_names):
+        # 缩放合并源中尚未缩放的字形，度量表和字体头只在第一次时缩放
+        try:
+            if not merge_source.metrics_scaled:
+                self.scale_font_metrics(merge_source.font, merge_source.scale_factor)
+                merge_source.metrics_scaled = True
+            pending_names = [glyph_name for glyph_name in glyph_names if glyph_name not in merge_source.scaled_glyphs]
+            self.scale_glyphs(merge_source.font, merge_source.scale_factor, pending_names)
+            merge_source.scaled_glyphs.update(pending_names)
+            merge_source.expanded_glyphs.update(pending_names)
+        except Exception as e:
+            print(f"警告: 缩放字体时出错: {str(e)}")
+    
+    def select_source_glyphs(self, merge_font, codepoints=None):
+        # 返回需要从合并字体导入的字形
+        glyph_order = merge_font.getGlyphOrder()
+        if 'glyf' in merge_font:
+            merge_glyf = merge_font['glyf']
+            get_components = lambda glyph_name: get_component_names(merge_glyf, glyph_name, glyph_order)
+        else:
+            # CFF字形没有复合字形
+            get_components = lambda glyph_name: ()
+        return self.select_import_glyphs(
+            glyph_order, get_unicode_mapping(merge_font['cmap']), get_components, codepoints,
+            lambda glyph_names: get_gsub_closure(merge_font, glyph_names)
+        )
+    
+    def select_import_glyphs(self, glyph_order, merge_mapping, get_components, codepoints=None, get_substitutes=None):
+        # 按合并字体的字形顺序返回需要导入的字形，get_components返回复合字形引用的组件名称
+        # get_substitutes返回字形集合以及通过GSUB替换可以得到的字形（连字等），为空时不做替换闭包
+        # 未指定码位集合时导入所有与已有字形不同名的字形；同名字形只在输出会映射到它，
+        # 或被导入的字形通过GSUB替换或复合字形引用时导入（导入时重命名）
+        # 指定码位集合时只导入集合内输出会映射到的字形，以及它们的GSUB替换结果和复合字形引用的组件
+        glyph_index = self.glyph_index
+        mapped_names = self.filter_source_mapping(merge_mapping, codepoints).values()
+        if codepoints is None:
+            pending = [glyph_name for glyph_name in glyph_order if glyph_name not in glyph_index]
+            pending.extend(glyph_name for glyph_name in mapped_names if glyph_name in glyph_index)
+        else:
+            pending = list(mapped_names)
+        if get_substitutes is not None:
+            pending = get_substitutes(pending)
+        return get_reachable_glyphs(glyph_order, pending, get_components)
+    
+    def filter_source_mapping(self, merge_mapping, codepoints=None):
+        # 返回合并字体中需要写入输出的码位映射：指定了子集时只保留集合内的码位，
+        # keep策略下跳过输出中已有的码位
+        codepoint_index = self.codepoint_index
+        override = self.conflict_policy == CONFLICT_OVERRIDE
+        return {
+            code: glyph_name
+            for code, glyph_name in merge_mapping.items()
+            if (codepoints is None or code in codepoints) and (override or code not in codepoint_index)
+        }
+    
+    def get_units_per_em(self, font):
+        # 获取字体的EM大小（通常在head表中）
+        if 'head' in font:
+            return font['head'].unitsPerEm
+        return 1000  # 默认值
+    
+    def scale_font_glyphs(self, font, scale_factor, glyph_names=None):
+        # 缩放字体的字形和相关表，glyph_names为空时缩放所有字形
+        try:
+            self.scale_font_metrics(font, scale_factor)
+            self.scale_glyphs(font, scale_factor, font.getGlyphOrder() if glyph_names is None else glyph_names)
+        except Exception as e:
+            print(f"警告: 缩放字体时出错: {str(e)}")
+    
+    def scale_glyphs(self, font, scale_factor, glyph_names):
+        # 批量缩放glyf表中的字形，并让hmtx的左侧空白与缩放后的xMin保持一致（相位点随之正确）
+        # 需要在scale_font_metrics之后调用
+        if 'glyf' not in font or not glyph_names:
+            return
+        glyph_x_min = self.scale_glyf_table(font['glyf'], glyph_names, scale_factor)
+        if 'hmtx' in font:
+            metrics = font['hmtx'].metrics
+            for glyph_name, x_min in glyph_x_min.items():
+                if glyph_name in metrics:
+                    metrics[glyph_name] = (metrics[glyph_name][0], x_min)
+    
+    def scale_font_metrics(self, font, scale_factor):
+        # 缩放与字形无关的度量：hmtx/vmtx以及字体头中的相关值
+        # 1. 缩放hmtx表中的水平度量
+        if 'hmtx' in font:
+            self.scale_metrics_table(font['hmtx'], scale_factor)
+        
+        # 2. 缩放vmtx表中的垂直度量（如果存在）
+        if 'vmtx' in font:
+            self.scale_metrics_table(font['vmtx'], scale_factor)
+        
+        # 3. 更新head表中的unitsPerEm
+        if 'head' in font:
+            font['head'].unitsPerEm = round(font['head'].unitsPerEm * scale_factor)
+        
+        # 4. 更新hhea表中的相关值
+        if 'hhea' in font:
+            hhea = font['hhea']
+            hhea.ascent = round(hhea.ascent * scale_factor)
+            hhea.descent = round(hhea.descent * scale_factor)
+            hhea.lineGap = round(hhea.lineGap * scale_factor)
+            hhea.advanceWidthMax = round(hhea.advanceWidthMax * scale_factor)
+        
+        # 5. 更新OS/2表中的相关值
+        if 'OS/2' in font:
+            os2 = font['OS/2']
+            for attr in ('sTypoAscender', 'sTypoDescender', 'sTypoLineGap', 'usWinAscent', 'usWinDescent'):
+                if hasattr(os2, attr):
+                    setattr(os2, attr, round(getattr(os2, attr) * scale_factor))
+    
+    def scale_glyf_table(self, glyf_table, glyph_names, scale_factor):
+        # 把所有简单字形的坐标拼接为一个连续的NumPy数组，一次完成缩放、取整和边界计算
+        # 返回简单字形缩放后的xMin，用于同步hmtx的左侧空白
+        simple_names = []
+        simple_glyphs = []
+        composite_glyphs = []
+        for glyph_name in glyph_names:
+            glyph = glyf_table[glyph_name]
+            if glyph.isComposite():
+                composite_glyphs.append(glyph)
+            elif glyph.numberOfContours > 0 and len(glyph.coordinates):
+                simple_names.append(glyph_name)
+                simple_glyphs.append(glyph)
+        
+        glyph_x_min = {}
+        if simple_glyphs:
+            coordinate_arrays = [glyph.coordinates.array for glyph in simple_glyphs]
+            counts = np.fromiter((len(a) for a in coordinate_arrays), dtype=np.int64, count=len(coordinate_arrays))
+            offsets = np.zeros(len(counts), dtype=np.int64)
+            np.cumsum(counts[:-1], out=offsets[1:])
+            
+            flat = np.concatenate([np.frombuffer(a, dtype=np.float64) for a in coordinate_arrays])
+            flat = np.round(flat * scale_factor)
+            
+            # 按字形分段计算边界
+            xs = flat[0::2]
+            ys = flat[1::2]
+            point_offsets = offsets // 2
+            x_min = np.minimum.reduceat(xs, point_offsets).astype(np.int64).tolist()
+            x_max = np.maximum.reduceat(xs, point_offsets).astype(np.int64).tolist()
+            y_min = np.minimum.reduceat(ys, point_offsets).astype(np.int64).tolist()
+            y_max = np.maximum.reduceat(ys, point_offsets).astype(np.int64).tolist()
+            
+            # 写回每个字形的坐标数组（C层面的切片复制）
+            scaled = array('d', flat.tobytes())
+            starts = offsets.tolist()
+            ends = (offsets + counts).tolist()
+            for i, glyph in enumerate(simple_glyphs):
+                coordinate_arrays[i][:] = scaled[starts[i]:ends[i]]
+                glyph.xMin, glyph.yMin, glyph.xMax, glyph.yMax = x_min[i], y_min[i], x_max[i], y_max[i]
+            glyph_x_min = dict(zip(simple_names, x_min))
+        
+        if composite_glyphs:
+            # 复合字形只需缩放组件偏移，变换矩阵是相对量保持不变
+            components = [
+                component
+                for glyph in composite_glyphs
+                for component in glyph.components
+                if not hasattr(component, 'firstPt')
+            ]
+            if components:
+                offsets_xy = np.array([(component.x, component.y) for component in components], dtype=np.float64)
+                offsets_xy = np.round(offsets_xy * scale_factor).astype(np.int64).tolist()
+                for component, (x, y) in zip(components, offsets_xy):
+                    component.x = x
+                    component.y = y
+            
+            # 复合字形的边界先按比例缩放，保存时会根据组件重新计算
+            bounds = np.array(
+                [(glyph.xMin, glyph.yMin, glyph.xMax, glyph.yMax) for glyph in composite_glyphs],
+                dtype=np.float64,
+            )
+            bounds = np.round(bounds * scale_factor).astype(np.int64).tolist()
+            for glyph, (x_min_c, y_min_c, x_max_c, y_max_c) in zip(composite_glyphs, bounds):
+                glyph.xMin, glyph.yMin, glyph.xMax, glyph.yMax = x_min_c, y_min_c, x_max_c, y_max_c
+        
+        return glyph_x_min
+    
+    def scale_metrics_table(self, metrics_table, scale_factor):
+        # 以数组方式缩放hmtx/vmtx度量
+        metrics = metrics_table.metrics
+        names = list(metrics)
+        if not names:
+            return
+        values = np.array([metrics[glyph_name] for glyph_name in names], dtype=np.float64)
+        values = np.round(values * scale_factor).astype(np.int64)
+        metrics_table.metrics = dict(zip(names, zip(values[:, 0].tolist(), values[:, 1].tolist())))
+    
+    def merge_font_data(self, base_font, merge_font, glyph_names, raw_glyphs=False, codepoints=None,
+                        outline_scale=None, merge_source=None, layout_key=None):
+        # 开始记录本字体新增的字形，并为同名字形分配新名称
+        self.glyph_index.begin_source(glyph_names)
+        
+        # 1. 首先合并字形表
+        with self.profile.stage('glyphs'):
+            if self.glyph_spill is not None and (outline_scale is not None or not raw_glyphs):
+                self.merge_glyph_chunks(base_font, merge_source, glyph_names, outline_scale)
+            elif outline_scale is not None:
+                self.merge_converted_glyphs(base_font, merge_font, glyph_names, outline_scale)
+            elif raw_glyphs:
+                self.merge_raw_glyphs(base_font, merge_font, glyph_names)
+            else:
+                self.merge_glyphs(base_font, merge_font, glyph_names)
+            if self.glyph_spill is not None:
+                self.spill_glyphs(base_font, self.glyph_index.added_sources, merge_font)
+        
+        with self.profile.stage('metrics'):
+            # 2. 合并水平度量表
+            self.merge_hmtx(base_font, merge_font)
+            
+            # 3. 合并垂直度量表（如果存在）
+            if 'vmtx' in base_font and 'vmtx' in merge_font:
+                self.merge_vmtx(base_font, merge_font)
+            
+            # 4. 更新maxp表
+            self.update_maxp_table(base_font)
+        
+        # 5. 合并cmap表
+        with self.profile.stage('cmap'):
+            self.merge_cmaps(base_font, merge_font, codepoints)
+        
+        # 6. 合并名称表（OS/2表的统计在所有字体合并完成后统一更新）
+        self.merge_name_table(base_font, merge_font)
+        
+        # 7. 合并布局表
+        with self.profile.stage('layout'):
+            self.merge_layout_tables(
+                base_font, merge_font, merge_source.scale_factor if merge_source is not None else 1.0, layout_key
+            )
+    
+    def merge_cached_font_data(self, base_font, merge_font, cached_subset, import_glyph_names, codepoints=None,
+                               scale_factor=1.0, layout_key=None):
+        # 从字形子集（磁盘缓存或工作进程预处理的结果）拼接字形：编译好的字形数据直接写入，只改写复合字形的组件GID
+        # 合并字体只用于读取名称表等少量数据
+        self.glyph_index.begin_source(import_glyph_names)
+        
+        # 1. 拼接字形数据
+        with self.profile.stage('glyphs'):
+            cached_glyphs = list(cached_subset.iter_glyphs(import_glyph_names))
+            self.splice_glyph_data(
+                base_font, cached_subset.glyph_order, [(glyph_name, data) for glyph_name, data, _, _ in cached_glyphs]
+            )
+            if self.glyph_spill is not None:
+                self.spill_glyphs(base_font, self.glyph_index.added_sources)
+        
+        # 2. 拼接度量
+        with self.profile.stage('metrics'):
+            base_hmtx = base_font['hmtx'].metrics
+            base_vmtx = base_font['vmtx'].metrics if 'vmtx' in base_font and cached_subset.has_vmtx else None
+            get_output_name = self.glyph_index.get_output_name
+            for source_name, _, metrics, vertical_metrics in cached_glyphs:
+                glyph_name = get_output_name(source_name)
+                base_hmtx[glyph_name] = metrics
+                if base_vmtx is not None:
+                    base_vmtx[glyph_name] = vertical_metrics
+            
+            # 3. 更新maxp表
+            self.update_maxp_table(base_font)
+        
+        # 4. 合并cmap表
+        with self.profile.stage('cmap'):
+            self.merge_cmap_mapping(base_font['cmap'], cached_subset.get_cmap(), codepoints)
+        
+        # 5. 合并名称表
+        self.merge_name_table(base_font, merge_font)
+        
+        # 6. 合并布局表，scale_factor为字形子集使用的缩放比例
+        with self.profile.stage('layout'):
+            self.merge_layout_tables(base_font, merge_font, scale_factor, layout_key)
+    
+    def merge_layout_tables(self, base_font, merge_font, scale_factor=1.0, layout_key=None):
+        # 合并GSUB、GPOS、GDEF和kern表：字形按本字体的导入结果重映射，引用未导入字形的规则被删除，
+        # 位置调整按缩放比例缩放；layout_key不为空时，重映射后的表按字形映射缓存到磁盘字形缓存中
+        glyph_map = self.glyph_index.source_map
+        if not glyph_map or not any(tag in merge_font for tag in LAYOUT_TABLE_TAGS):
+            return
+        if 'fvar' in merge_font:
+            print("警告: 不支持合并可变字体的布局表，已跳过（可以为该字体配置轴坐标，实例化后合并）")
+            return
+        try:
+            tables = None
+            cache_key = None
+            if layout_key is not None:
+                cache_key = make_layout_cache_key(layout_key, glyph_map)
+                data = self.glyph_cache.load_layout(cache_key)
+                if data is not None:
+                    try:
+                        tables = unpack_layout_tables(data)
+                    except Exception as e:
+                        print(f"警告: 布局表缓存无效，重新生成: {str(e)}")
+            if tables is None:
+                tables = extract_layout_tables(merge_font, glyph_map, scale_factor)
+                if cache_key is not None:
+                    self.glyph_cache.store_layout(cache_key, pack_layout_tables(tables, self.glyph_index.added))
+            if tables:
+                merge_layout_tables(base_font, tables)
+                self.layout_merged = True
+        except Exception as e:
+            print(f"警告: 合并布局表时出错: {str(e)}")
+    
+    def extract_glyphs(self, merge_font, glyph_names):
+        # 返回字形子集中的(字形名称, 编译后的数据, (advance, lsb), (v_advance, tsb)或None)列表
+        merge_glyf = merge_font['glyf']
+        merge_hmtx = merge_font['hmtx'].metrics
+        merge_vmtx = merge_font['vmtx'].metrics if 'vmtx' in merge_font else None
+        glyphs = []
+        for glyph_name in glyph_names:
+            try:
+                data = get_glyph_data(merge_glyf, glyph_name)
+            except Exception as e:
+                print(f"警告: 无法合并字形 '{glyph_name}': {str(e)}")
+                continue
+            glyphs.append((
+                glyph_name,
+                data,
+                merge_hmtx.get(glyph_name, (0, 0)),
+                merge_vmtx.get(glyph_name, (0, 0)) if merge_vmtx is not None else None,
+            ))
+        return glyphs
+    
+    def extract_converted_glyphs(self, merge_font, glyph_names, base_units_per_em, scale_factor):
+        # 与merge_converted_glyphs相同，把CFF字形转换为glyf字形，返回字形子集中的记录
+        glyph_set = merge_font.getGlyphSet()
+        merge_hmtx = merge_font['hmtx'].metrics
+        merge_vmtx = merge_font['vmtx'].metrics if 'vmtx' in merge_font else None
+        max_err = get_cu2qu_max_err(base_units_per_em)
+        glyf_table = newTable('glyf')
+        glyf_table.glyphs = {}
+        glyphs = []
+        for glyph_name in glyph_names:
+            try:
+                glyph = convert_to_glyf_glyph(glyph_set, glyph_name, glyf_table, max_err, scale_factor)
+                data = glyph.compile(glyf_table)
+            except Exception as e:
+                print(f"警告: 无法转换字形 '{glyph_name}': {str(e)}")
+                continue
+            glyphs.append((
+                glyph_name,
+                data,
+                (merge_hmtx.get(glyph_name, (0, 0))[0], getattr(glyph, 'xMin', 0)),
+                merge_vmtx.get(glyph_name, (0, 0)) if merge_vmtx is not None else None,
+            ))
+        return glyphs
+    
+    def store_glyph_subset(self, subset_key, merge_font):
+        # 把本次从合并字体导入的字形编译后写入磁盘缓存，组件GID保持为合并字体中的GID
+        try:
+            merge_glyf = merge_font['glyf']
+            merge_hmtx = merge_font['hmtx']
+            merge_vmtx = merge_font['vmtx'] if 'vmtx' in merge_font else None
+            glyphs = []
+            for glyph_name in self.glyph_index.added_sources:
+                glyphs.append((
+                    glyph_name,
+                    get_glyph_data(merge_glyf, glyph_name),
+                    merge_hmtx[glyph_name],
+                    merge_vmtx[glyph_name] if merge_vmtx is not None else None,
+                ))
+            self.glyph_cache.store(
+                subset_key,
+                merge_font.getGlyphOrder(),
+                glyphs,
+                get_unicode_mapping(merge_font['cmap']),
+                merge_vmtx is not None
+            )
+        except Exception as e:
+            print(f"警告: 写入字形缓存时出错: {str(e)}")
+        
+    def merge_glyphs(self, base_font, merge_font, glyph_names):
+        # 获取基础字体和要合并字体的glyf表
+        base_glyf = base_font['glyf']
+        merge_glyf = merge_font['glyf']
+        glyph_index = self.glyph_index
+        
+        # 合并字形数据，同名字形按重命名表写入新名称
+        for i, glyph_name in enumerate(glyph_names):
+            self.report_glyph_progress(i, len(glyph_names))
+            try:
+                # 直接写入glyphs字典并由索引维护字形顺序，避免glyf.__setitem__的列表查找
+                glyph = merge_glyf[glyph_name]
+                if glyph.isComposite():
+                    glyph = self.rename_glyph_components(glyph)
+                base_glyf.glyphs[glyph_index.get_output_name(glyph_name)] = glyph
+                glyph_index.add(glyph_name)
+            except Exception as e:
+                # 某些特殊字形可能无法直接复制，记录但继续处理
+                print(f"警告: 无法合并字形 '{glyph_name}': {str(e)}")
+    
+    def merge_glyph_chunks(self, base_font, merge_source, glyph_names, outline_scale=None):
+        # 低内存模式：按内存预算分批缩放（或转换）并合并字形，每批合并后把字形数据写入临时文件并释放
+        # 复合字形及其引用的组件留到本字体合并结束后再写入，编译复合字形时需要根据组件计算边界
+        merge_font = merge_source.font
+        deferred_names = set()
+        if outline_scale is None:
+            merge_glyf = merge_font['glyf']
+            glyph_order = merge_font.getGlyphOrder()
+            get_components = lambda glyph_name: get_component_names(merge_glyf, glyph_name, glyph_order)
+            deferred_names.update(get_reachable_glyphs(
+                glyph_order, [glyph_name for glyph_name in glyph_names if get_components(glyph_name)], get_components
+            ))
+        
+        for chunk in self.iter_glyph_chunks(merge_font, glyph_names):
+            if outline_scale is not None:
+                self.merge_converted_glyphs(base_font, merge_font, chunk, outline_scale)
+            else:
+                self.scale_merge_source(merge_source, chunk)
+                self.merge_glyphs(base_font, merge_font, chunk)
+            self.spill_glyphs(
+                base_font, [glyph_name for glyph_name in chunk if glyph_name not in deferred_names], merge_font
+            )
+    
+    def iter_glyph_chunks(self, merge_font, glyph_names):
+        # 按内存预算把字形分批，每批展开后的字形估计不超过预算（单个字形超过预算时单独成批）
+        merge_glyphs = merge_font['glyf'].glyphs if 'glyf' in merge_font else {}
+        chunk = []
+        chunk_size = 0
+        for glyph_name in glyph_names:
+            data = getattr(merge_glyphs.get(glyph_name), 'data', None)
+            if data is not None:
+                size = EXPANDED_GLYPH_OVERHEAD + len(data) * EXPANDED_GLYPH_FACTOR
+            else:
+                size = EXPANDED_GLYPH_ESTIMATE
+            if chunk and chunk_size + size > self.memory_budget:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+            chunk.append(glyph_name)
+            chunk_size += size
+        if chunk:
+            yield chunk
+    
+    def spill_glyphs(self, base_font, source_names, merge_font=None):
+        # 把已合并的字形编译后写入临时文件，并从基础字体和合并字体的glyf表中移除
+        # 启用磁盘字形缓存时合并字体中的简单字形替换为编译后的数据，合并完成后仍可写入缓存
+        base_glyf = base_font['glyf']
+        merge_glyphs = merge_font['glyf'].glyphs if merge_font is not None and 'glyf' in merge_font else {}
+        source_map = self.glyph_index.source_map
+        # 先编译全部字形再移除，复合字形编译时仍能读取组件
+        glyph_records = []
+        for source_name in source_names:
+            glyph_name = source_map.get(source_name)
+            if glyph_name is not None and glyph_name in base_glyf.glyphs:
+                glyph_records.append((source_name, glyph_name, get_glyph_data(base_glyf, glyph_name)))
+        for source_name, glyph_name, data in glyph_records:
+            del base_glyf.glyphs[glyph_name]
+            self.glyph_spill.put(glyph_name, data)
+            if source_name not in merge_glyphs or is_composite_data(data):
+                continue
+            if self.glyph_cache is None:
+                del merge_glyphs[source_name]
+            elif not hasattr(merge_glyphs[source_name], 'data'):
+                merge_glyphs[source_name] = Glyph(data)
+    
+    def rename_glyph_components(self, glyph):
+        # 组件引用了被重命名的字形时返回改写了组件名称的副本，合并字体中的字形保持不变
+        renames = self.glyph_index.renames
+        if not any(component.glyphName in renames for component in glyph.components):
+            return glyph
+        new_glyph = copy.copy(glyph)
+        new_glyph.components = []
+        for component in glyph.components:
+            new_component = copy.copy(component)
+            new_component.glyphName = renames.get(component.glyphName, component.glyphName)
+            new_glyph.components.append(new_component)
+        return new_glyph
+    
+    def merge_converted_glyphs(self, base_font, merge_font, glyph_names, scale_factor):
+        # 字形格式不同时只转换被导入的字形：CFF字形转换为二次曲线写入glyf，或glyf字形转换为CFF字形
+        # 转换后的左边距写回合并字体的hmtx表，随后由merge_hmtx复制
+        glyph_set = merge_font.getGlyphSet()
+        merge_hmtx = merge_font['hmtx']
+        glyph_index = self.glyph_index
+        if 'glyf' in base_font:
+            base_glyf = base_font['glyf']
+            max_err = get_cu2qu_max_err(self.get_units_per_em(base_font))
+        else:
+            base_cff = base_font['CFF '].cff
+        
+        for i, glyph_name in enumerate(glyph_names):
+            self.report_glyph_progress(i, len(glyph_names))
+            output_name = glyph_index.get_output_name(glyph_name)
+            try:
+                advance = merge_hmtx[glyph_name][0]
+                if 'glyf' in base_font:
+                    glyph = convert_to_glyf_glyph(glyph_set, glyph_name, base_glyf, max_err, scale_factor)
+                    base_glyf.glyphs[output_name] = glyph
+                    x_min = getattr(glyph, 'xMin', 0)
+                else:
+                    charstring = convert_to_charstring(glyph_set, glyph_name, base_cff, advance, scale_factor)
+                    x_min = get_charstring_xmin(base_cff, charstring)
+                    add_charstring(base_cff, output_name, charstring)
+                glyph_index.add(glyph_name)
+                merge_hmtx[glyph_name] = (advance, x_min)
+            except Exception as e:
+                print(f"警告: 无法转换字形 '{glyph_name}': {str(e)}")
+    
+    def merge_raw_glyphs(self, base_font, merge_font, glyph_names):
+        # 未缩放的合并字体：直接拷贝glyf表中编译好的字形数据，不把字形解码为Python对象
+        merge_glyf = merge_font['glyf']
+        glyph_records = []
+        for glyph_name in glyph_names:
+            try:
+                glyph_records.append((glyph_name, get_glyph_data(merge_glyf, glyph_name)))
+            except Exception as e:
+                print(f"警告: 无法合并字形 '{glyph_name}': {str(e)}")
+        self.splice_glyph_data(base_font, merge_font.getGlyphOrder(), glyph_records)
+    
+    def splice_glyph_data(self, base_font, source_glyph_order, glyph_records):
+        # 把(源字形名称, 编译后的数据)追加到基础字体，只改写复合字形的组件GID
+        # source_glyph_order为数据中组件GID所对应的字形顺序，组件名称按重命名表转换为输出中的名称
+        glyph_index = self.glyph_index
+        
+        # 先为所有导入的字形分配GID，复合字形才能引用排在后面的组件
+        for glyph_name, _ in glyph_records:
+            glyph_index.add(glyph_name)
+        
+        get_gid = glyph_index.gid_map.__getitem__
+        get_output_name = glyph_index.get_output_name
+        remap_gid = lambda source_gid: get_gid(get_output_name(source_glyph_order[source_gid]))
+        
+        base_glyphs = base_font['glyf'].glyphs
+        for i, (glyph_name, data) in enumerate(glyph_records):
+            self.report_glyph_progress(i, len(glyph_records))
+            if is_composite_data(data):
+                try:
+                    data = remap_component_gids(data, remap_gid)
+                except Exception as e:
+                    # 组件在基础字体中不存在，写入空字形以保持GID不变
+                    print(f"警告: 无法合并复合字形 '{glyph_name}': {str(e)}")
+                    data = b''
+            base_glyphs[get_output_name(glyph_name)] = Glyph(data)
+    
+    def merge_hmtx(self, base_font, merge_font):
+        # 获取基础字体和要合并字体的hmtx表
+        base_hmtx = base_font['hmtx']
+        merge_hmtx = merge_font['hmtx']
+        
+        # 只处理本次新增的字形，度量按源字形名称读取
+        for glyph_name, source_name in zip(self.glyph_index.added, self.glyph_index.added_sources):
+            try:
+                # 获取该字形的水平度量
+                width, lsb = merge_hmtx[source_name]
+                # 添加到基础字体的hmtx表
+                base_hmtx[glyph_name] = (width, lsb)
+            except Exception:
+                # 如果获取度量失败，使用默认值
+                base_hmtx[glyph_name] = (0, 0)
+    
+    def merge_vmtx(self, base_font, merge_font):
+        # 获取基础字体和要合并字体的vmtx表
+        base_vmtx = base_font['vmtx']
+        merge_vmtx = merge_font['vmtx']
+        
+        # 只处理本次新增的字形，度量按源字形名称读取
+        for glyph_name, source_name in zip(self.glyph_index.added, self.glyph_index.added_sources):
+            try:
+                # 获取该字形的垂直度量
+                height, tsb = merge_vmtx[source_name]
+                # 添加到基础字体的vmtx表
+                base_vmtx[glyph_name] = (height, tsb)
+            except Exception:
+                # 如果获取度量失败，使用默认值
+                base_vmtx[glyph_name] = (0, 0)
+    
+    def update_maxp_table(self, base_font):
+        # 更新maxp表中的glyph数量
+        if 'maxp' in base_font:
+            base_font['maxp'].numGlyphs = len(base_font.getGlyphOrder())
+    
+    def merge_cmaps(self, base_font, merge_font, codepoints=None):
+        # 合并字体的所有Unicode子表统一为一个映射，相同的子表只遍历一次
+        self.merge_cmap_mapping(base_font['cmap'], get_unicode_mapping(merge_font['cmap']), codepoints)
+    
+    def merge_cmap_mapping(self, base_cmap, merge_mapping, codepoints=None):
+        codepoint_index = self.codepoint_index
+        source_map = self.glyph_index.source_map
+        
+        # 按冲突策略和子集码位筛选码位，只映射到本字体导入的字形（使用重命名后的名称）
+        new_mappings = {}
+        for code, glyph_name in self.filter_source_mapping(merge_mapping, codepoints).items():
+            output_name = source_map.get(glyph_name)
+            if output_name is not None:
+                new_mappings[code] = output_name
+        
+        # 记录被覆盖的码位原来映射的字形
+        for code, glyph_name in new_mappings.items():
+            previous_name = codepoint_index.get(code)
+            if previous_name is not None and previous_name != glyph_name:
+                self.cmap_overrides.setdefault(code, previous_name)
+        
+        if new_mappings:
+            self.write_cmap_mappings(base_cmap, new_mappings)
+            codepoint_index.update(new_mappings)
+    
+    def write_cmap_mappings(self, base_cmap, new_mappings):
+        # 一次性把新增映射写入基础字体的所有Unicode子表
+        # BMP码位写入format 4等子表，BMP以外的码位只写入format 12子表
+        bmp_mappings = {code: name for code, name in new_mappings.items() if code <= 0xFFFF}
+        
+        # 需要时补充缺失的子表，新子表包含当前全部映射
+        # 是否存在按所有子表判断：内容与format 4相同的format 12子表（只有BMP码位）也算已存在，不能重复添加
+        # 同一(platformID, platEncID, language)已有其他格式的子表时也不添加，否则保存时会因重复而失败
+        unicode_formats = {table.format for table in base_cmap.tables if table.isUnicode()}
+        existing_keys = {(table.platformID, table.platEncID, table.language) for table in base_cmap.tables}
+        if not unicode_formats & set(CMAP_BMP_FORMATS) and (3, 1, 0) not in existing_keys:
+            bmp_existing = {code: name for code, name in self.codepoint_index.mapping.items() if code <= 0xFFFF}
+            base_cmap.tables.append(new_cmap_subtable(4, 3, 1, bmp_existing))
+        if (len(bmp_mappings) != len(new_mappings) and not unicode_formats & set(CMAP_FULL_FORMATS)
+                and (3, 10, 0) not in existing_keys):
+            base_cmap.tables.append(new_cmap_subtable(12, 3, 10, self.codepoint_index.mapping))
+        
+        # 共享同一映射字典的子表只写一次
+        written = set()
+        for table in base_cmap.tables:
+            if not table.isUnicode() or id(table.cmap) in written:
+                continue
+            if table.format in CMAP_FULL_FORMATS:
+                table.cmap.update(new_mappings)
+            elif table.format in CMAP_BMP_FORMATS:
+                table.cmap.update(bmp_mappings)
+            else:
+                continue
+            written.add(id(table.cmap))
+    
+    def update_os2_table(self, base_font):
+        # 所有字体合并完成后按最终的度量和码位更新OS/2的平均字宽和Unicode范围
+        # 码位直接取自码位索引，不再遍历cmap的各个子表
+        if 'OS/2' not in base_font:
+            return
+        os2 = base_font['OS/2']
+        os2.recalcAvgCharWidth(base_font)
+        os2.setUnicodeRanges(intersectUnicodeRanges(self.codepoint_index.mapping))
+    
+    def merge_name_table(self, base_font, merge_font):
+        # 获取基础字体和要合并字体的name表
+        base_name = base_font['name']
+        merge_name = merge_font['name']
+        
+        # 合并名称记录
+        name_ids = {record.nameID for record in base_name.names}
+        for record in merge_name.names:
+            if record.nameID not in name_ids:
+                base_name.names.append(record)
+                self.names_merged = True
+    
+    def finalize_font_tables(self, base_font):
+        # 这个方法在所有字体合并完成后调用，用于确保所有表的一致性
+        # 返回编译后的字体数据，整个保存流程只编译一次
+        self.check_font_tables(base_font)
+        
+        # TrueType字体在这里一次汇总字形统计，保存时跳过fontTools逐个解码字形的重新计算
+        # CFF字体的边界框仍在保存时由fontTools计算
+        if 'glyf' in base_font:
+            update_glyf_stats(base_font)
+        
+        # 在内存中编译字体（以压缩格式的上次输出为基础时，仍然编译为未压缩的字体）
+        base_font.flavor = None
+        buffer = io.BytesIO()
+        base_font.save(buffer)
+        font_data = buffer.getvalue()
+        
+        # 从同一份数据重新加载验证
+        try:
+            self.validate_font_data(io.BytesIO(font_data), len(base_font.getGlyphOrder()))
+        except Exception as e:
+            print(f"警告: 最终验证字体表时出错，但仍尝试保存: {str(e)}")
+        
+        return font_data
+    
+    def write_streamed_font(self, base_font, to_output):
+        # 低内存模式的finalize_font_tables：字形数据从临时文件逐个读取并流式写出
+        # to_output为真时直接原子写入输出文件并返回None，否则（需要压缩输出时）返回内存中的字体数据
+        self.check_font_tables(base_font)
+        
+        base_glyf = base_font['glyf']
+        glyph_spill = self.glyph_spill
+        def get_data(glyph_name):
+            if glyph_name in glyph_spill:
+                return glyph_spill.get(glyph_name)
+            return get_glyph_data(base_glyf, glyph_name)
+        
+        base_font.flavor = None
+        num_glyphs = len(base_font.getGlyphOrder())
+        font_data = None
+        if to_output:
+            with open_atomic(self.output_path, 'w+b') as f:
+                write_font_streamed(base_font, f, get_data)
+                # 以上次的输出为基础时，基础字体仍在延迟读取输出文件，替换前关闭
+                base_font.close()
+        else:
+            with io.BytesIO() as buffer:
+                write_font_streamed(base_font, buffer, get_data)
+                font_data = buffer.getvalue()
+        
+        try:
+            self.validate_font_data(self.output_path if to_output else io.BytesIO(font_data), num_glyphs)
+        except Exception as e:
+            print(f"警告: 最终验证字体表时出错，但仍尝试保存: {str(e)}")
+        
+        return font_data
+    
+    def check_font_tables(self, base_font):
+        # 确保度量表包含所有字形，并更新maxp中的字形数量
+        try:
+            # 更新glyf顺序
+            new_glyph_order = base_font.getGlyphOrder()
+            
+            # 确保hmtx表和vmtx表有所有字形的度量
+            for tag in ('hmtx', 'vmtx'):
+                if tag in base_font:
+                    metrics = base_font[tag].metrics
+                    for glyph_name in new_glyph_order:
+                        if glyph_name not in metrics:
+                            metrics[glyph_name] = (0, 0)
+            
+            # 确保maxp表正确
+            self.update_maxp_table(base_font)
+            
+            # 更新OS/2的平均字宽和Unicode范围
+            self.update_os2_table(base_font)
+            
+        except Exception as e:
+            print(f"警告: 最终检查字体表时出错，但仍尝试保存: {str(e)}")
+    
+    def validate_font_data(self, font_file, num_glyphs):
+        # 检查编译结果能否被重新解析，且字形数量一致，font_file为文件路径或文件对象
+        temp_font = TTFont(font_file)
+        try:
+            if 'maxp' in temp_font and temp_font['maxp'].numGlyphs != num_glyphs:
+                raise ValueError(f"maxp字形数量不一致: {temp_font['maxp'].numGlyphs} != {num_glyphs}")
+            if 'glyf' in temp_font and 'loca' in temp_font and len(temp_font['loca']) != num_glyphs + 1:
+                raise ValueError("loca表长度与字形数量不一致")
+        finally:
+            temp_font.close()
+
+    def apply_final_font_config(self, font):        
+        # 应用最终字体配置
+        try:
+            # 设置字体名称相关信息
+            if 'name' in font and 'font_name' in self.final_font_config:
+                name_table = font['name']
+                font_name = self.final_font_config['font_name']
+                family_name = self.final_font_config.get('family_name', font_name)
+                style_name = self.final_font_config.get('style_name', '')
+                version = self.final_font_config.get('version', 'Version 1.000')
+                
+                # 移除现有的名称记录
+                # name_table.names = []
+                
+                # 添加新的名称记录
+                # 英文名称记录
+                name_table.setName(font_name, 4, 3, 1, 1033)  # 全名
+                name_table.setName(family_name, 1, 3, 1, 1033)  # 字体系列
+                name_table.setName(style_name, 2, 3, 1, 1033)  # 字体样式
+                name_table.setName(version, 5, 3, 1, 1033)  # 版本
+                
+                # 中文名称记录
+                name_table.setName(font_name, 4, 3, 1, 2052)  # 全名
+                name_table.setName(family_name, 1, 3, 1, 2052)  # 字体系列
+                name_table.setName(style_name, 2, 3, 1, 2052)  # 字体样式
+                name_table.setName(version, 5, 3, 1, 2052)  # 版本
+            
+        except Exception as e:
+            print(f"警告: 设置最终字体配置时出错: {str(e)}")
@@ -0,0 +1,148 @@
+import sys
+import time
+import json
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Windows上没有resource模块
+    resource = None
+
+# 合并过程的分阶段性能记录：每个阶段的耗时、进程峰值内存，以及每个源字体导入的字形和码位数量
+
+STAGE_LABELS = {
+    'load_base': '加载基础字体',
+    'load': '加载',
+    'instance': '实例化可变字体',
+    'prepare': '等待预处理',
+    'select': '选择字形',
+    'scale': '缩放',
+    'glyphs': '合并字形',
+    'metrics': '合并度量',
+    'cmap': '合并字符映射',
+    'layout': '合并布局表',
+    'finalize': '编译',
+    'save': '保存',
+    'compress': '压缩',
+}
+
+def get_peak_rss():
+    # 返回当前进程的峰值常驻内存（字节），无法获取时返回None
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS上单位为字节，Linux上为KB
+        return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+    if sys.platform == 'win32':
+        return get_windows_peak_rss()
+    return None
+
+def get_windows_peak_rss():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD),
+            ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    try:
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        return None
+
+class MergeProfile:
+    def __init__(self, stage_callback=None):
+        # stage_callback(阶段名称, 源字体名称)在进入每个阶段时调用，用于显示当前阶段
+        self.stage_callback = stage_callback
+        self.stages = []
+        self.sources = []
+        self.current_source = None
+        self.source_start_time = None
+        self.start_time = time.perf_counter()
+        self.total_time = None
+
+    @contextmanager
+    def stage(self, name):
+        # 记录一个阶段的耗时和结束时的进程峰值内存，阶段归属于当前源字体
+        source = self.current_source
+        if self.stage_callback is not None:
+            self.stage_callback(name, source)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({
+                'stage': name,
+                'source': source,
+                'elapsed': time.perf_counter() - start_time,
+                'peak_rss': get_peak_rss(),
+            })
+
+    def begin_source(self, source):
+        self.current_source = source
+        self.source_start_time = time.perf_counter()
+
+    def end_source(self, glyphs, codepoints):
+        # 记录当前源字体导入的字形数量和新增的码位数量
+        self.sources.append({
+            'source': self.current_source,
+            'glyphs': glyphs,
+            'codepoints': codepoints,
+            'elapsed': time.perf_counter() - self.source_start_time,
+        })
+        self.current_source = None
+
+    def finish(self):
+        self.current_source = None
+        self.total_time = time.perf_counter() - self.start_time
+
+    def get_stage_totals(self):
+        # 按阶段汇总耗时，保持阶段首次出现的顺序
+        totals = {}
+        for record in self.stages:
+            totals[record['stage']] = totals.get(record['stage'], 0.0) + record['elapsed']
+        return totals
+
+    def to_dict(self):
+        peak_rss = [record['peak_rss'] for record in self.stages if record['peak_rss'] is not None]
+        return {
+            'total_time': self.total_time,
+            'peak_rss': max(peak_rss) if peak_rss else None,
+            'stage_totals': self.get_stage_totals(),
+            'sources': self.sources,
+            'stages': self.stages,
+        }
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def format_report(self):
+        # 返回便于阅读的文本报告
+        lines = []
+        for name, elapsed in self.get_stage_totals().items():
+            lines.append(f"  {STAGE_LABELS.get(name, name)}: {elapsed:.3f}秒")
+        for source in self.sources:
+            lines.append(f"  {source['source']}: {source['glyphs']}个字形，{source['codepoints']}个码位，"
+                         f"{source['elapsed']:.3f}秒")
+        peak_rss = self.to_dict()['peak_rss']
+        if self.total_time is not None:
+            lines.append(f"  总耗时: {self.total_time:.3f}秒")
+        if peak_rss is not None:
+            lines.append(f"  峰值内存: {peak_rss / (1024 * 1024):.1f}MB")
+        return '\n'.join(lines)
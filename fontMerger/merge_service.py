@@ -0,0 +1,388 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fontTools.ttLib import TTFont
+from merge_engine import FontMergeEngine, FontMergeError
+from outline_convert import is_cff_font
+from source_cache import SourceCache
+from glyph_cache import GlyphSubsetCache
+from font_instance import InstanceCache
+from batch_merge import make_options, parse_job, run_merge_job
+from web_font import WEB_FORMATS, check_web_format
+
+# 常驻的合并服务：通过本地HTTP（TCP或Unix套接字）接收合并请求，供按需生成字体的后端调用
+# 合并在常驻的工作进程中执行，各进程保留已解析的源字体、实例和字形缓存，不需要每次重新启动和解析
+# 相同的请求在合并过程中只执行一次，完成后的输出按请求内容缓存在输出目录中，重复请求直接返回
+#
+# 接口:
+#   POST /merge   请求体为JSON，字段与任务清单中的任务相同（不需要output_path），另外可以指定
+#                 "format"（ttf、otf、woff或woff2），返回合并后的字体数据
+#                 ttf和otf必须与基础字体的轮廓格式一致（glyf为ttf，CFF为otf），不指定时按基础字体选择
+#                 请求中的路径都必须位于字体目录之内
+#   GET /stats    返回请求数量、缓存命中和延迟等统计信息（JSON）
+#
+# 响应头X-Merge-Source表示输出的来源: merge（本次合并）、shared（与进行中的相同请求共享）、cache（输出缓存）
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# 排队和正在合并的请求数量上限，超过时返回503
+DEFAULT_MAX_QUEUE = 64
+# 输出缓存目录的默认大小上限
+DEFAULT_OUTPUT_CACHE_SIZE = 1024 * 1024 * 1024
+# 请求体的大小上限
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+# 统计延迟时保留的最近请求数量
+LATENCY_WINDOW = 1000
+
+OUTPUT_FORMATS = {
+    'ttf': 'font/ttf',
+    'otf': 'font/otf',
+    'woff': 'font/woff',
+    'woff2': 'font/woff2',
+}
+
+HTTP_STATUS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+# 工作进程中常驻的(合并源缓存, 磁盘字形缓存, 实例缓存)，由init_service_worker创建，在所有请求之间共享
+worker_caches = None
+
+def init_service_worker(options, preload_paths):
+    # 工作进程启动时创建缓存，并预先解析常用的源字体
+    global worker_caches
+    source_cache = SourceCache(options['cache_size'])
+    glyph_cache = None
+    if options['cache_dir']:
+        glyph_cache = GlyphSubsetCache(options['cache_dir'], options['disk_cache_size'])
+    instance_cache = InstanceCache()
+    worker_caches = (source_cache, glyph_cache, instance_cache)
+    engine = FontMergeEngine(
+        preload_paths, os.devnull, source_cache=source_cache, glyph_cache=glyph_cache, instance_cache=instance_cache
+    )
+    for font_path in preload_paths:
+        try:
+            merge_source = engine.open_merge_source(font_path, None)
+            # 提前解析选择字形时需要的字形顺序和字符映射
+            merge_source.font.getGlyphOrder()
+            merge_source.font['cmap']
+        except Exception as e:
+            print(f"警告: 预加载字体 '{font_path}' 失败: {str(e)}", file=sys.stderr)
+
+def run_service_job(job, options):
+    # 在工作进程中执行一个合并请求，返回合并耗时
+    source_cache, glyph_cache, instance_cache = worker_caches
+    try:
+        _, elapsed, _ = run_merge_job(job, options, source_cache, glyph_cache, instance_cache)
+    finally:
+        source_cache.trim()
+    return elapsed
+
+def warm_up_worker():
+    # 启动时让每个工作进程完成初始化
+    return os.getpid()
+
+def make_job_key(job, output_format):
+    # 请求的缓存键：合并配置加上各输入文件的大小和修改时间，输入文件变化后不再命中旧的输出
+    input_paths = list(job['font_paths'])
+    for subset_config in job['font_subset_config'].values():
+        input_paths.extend(subset_config.get('text_files', []))
+    inputs = []
+    for path in input_paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise FontMergeError(f"文件不存在或无法读取: {path}") from None
+        inputs.append([os.path.realpath(path), stat.st_size, stat.st_mtime_ns])
+    payload = json.dumps({'job': job, 'inputs': inputs, 'format': output_format}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get_sfnt_format(font_path):
+    # 按基础字体的轮廓返回未压缩输出的格式：CFF轮廓为otf，glyf轮廓为ttf，合并后的字体沿用基础字体的轮廓
+    try:
+        font = TTFont(font_path, lazy=True)
+    except Exception:
+        raise FontMergeError(f"无法读取基础字体: {os.path.basename(font_path)}") from None
+    try:
+        return 'otf' if is_cff_font(font) else 'ttf'
+    finally:
+        font.close()
+
+def get_unavailable_formats():
+    # 返回当前环境无法输出的格式及原因，WOFF2依赖可选的brotli，在启动时检查一次
+    unavailable = {}
+    for output_format in OUTPUT_FORMATS:
+        if output_format in WEB_FORMATS:
+            try:
+                check_web_format(output_format)
+            except RuntimeError as e:
+                unavailable[output_format] = str(e)
+    return unavailable
+
+def is_path_inside(path, directory):
+    # 解析..和符号链接后path是否位于directory之内，directory应为realpath返回的路径
+    return os.path.commonpath([os.path.realpath(path), directory]) == directory
+
+def get_percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+class MergeService:
+    def __init__(self, font_dir, output_dir, options=None, workers=None, max_queue=DEFAULT_MAX_QUEUE,
+                 output_cache_size=DEFAULT_OUTPUT_CACHE_SIZE, preload_paths=()):
+        # font_dir为请求中相对路径的基准目录，合并后的字体缓存在output_dir中
+        self.font_dir = os.path.realpath(font_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        # 工作进程中不再并行预处理源字体，并发由工作进程数量控制
+        self.options = dict(options or make_options(), prepare_workers=0, incremental=False)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.output_cache_size = output_cache_size
+        self.preload_paths = [os.path.join(self.font_dir, path) for path in preload_paths]
+        self.executor = None
+        # 正在合并的请求：缓存键到合并任务的Future
+        self.in_flight = {}
+        self.stats = {'requests': 0, 'merged': 0, 'shared': 0, 'cache_hits': 0, 'failed': 0, 'rejected': 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.merge_times = deque(maxlen=LATENCY_WINDOW)
+        self.unavailable_formats = get_unavailable_formats()
+        for output_format, reason in self.unavailable_formats.items():
+            print(f"警告: 合并服务无法输出{output_format}: {reason}", file=sys.stderr)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def start_workers(self):
+        # 启动工作进程并等待它们完成初始化，第一个请求不需要承担启动开销
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=init_service_worker, initargs=(self.options, self.preload_paths)
+        )
+        futures = [self.executor.submit(warm_up_worker) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    async def start_server(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+        # 启动工作进程并开始监听，返回asyncio的服务器对象
+        await asyncio.get_running_loop().run_in_executor(None, self.start_workers)
+        if unix_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def handle_connection(self, reader, writer):
+        # 处理一个连接上的HTTP/1.1请求，支持keep-alive
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                try:
+                    length = int(headers.get('content-length') or 0)
+                    if length < 0:
+                        raise ValueError
+                except ValueError:
+                    # 无法确定请求体的边界，回复后关闭连接
+                    self.write_json(writer, 400, {'error': f"无效的Content-Length: {headers['content-length']}"}, False)
+                    await writer.drain()
+                    break
+                if length > MAX_REQUEST_SIZE:
+                    self.write_json(writer, 413, {'error': '请求体过大'}, False)
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, content_type, data, extra_headers = await self.dispatch(method, target.split('?')[0], body)
+                self.write_response(writer, status, content_type, data, extra_headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        # 返回(状态码, 内容类型, 响应数据, 附加响应头)
+        if path == '/merge':
+            if method != 'POST':
+                return self.json_result(405, {'error': '请使用POST'})
+            return await self.handle_merge(body)
+        if path == '/stats':
+            return self.json_result(200, self.get_stats())
+        return self.json_result(404, {'error': f'未知的路径: {path}'})
+
+    async def handle_merge(self, body):
+        start_time = time.perf_counter()
+        self.stats['requests'] += 1
+        try:
+            try:
+                request = json.loads(body.decode('utf-8'))
+            except ValueError as e:
+                raise ValueError(f"请求体不是有效的JSON: {str(e)}") from None
+            if not isinstance(request, dict):
+                raise ValueError("请求体应为JSON对象")
+            output_format = request.get('format')
+            if output_format is not None:
+                if not isinstance(output_format, str) or output_format not in OUTPUT_FORMATS:
+                    raise ValueError(f"不支持的输出格式: {output_format}，可用的格式: {', '.join(OUTPUT_FORMATS)}")
+                if output_format in self.unavailable_formats:
+                    raise ValueError(self.unavailable_formats[output_format])
+            job = parse_job(request, self.font_dir, '请求')
+            self.check_job_paths(job)
+            sfnt_format = get_sfnt_format(job['font_paths'][0])
+            if output_format is None:
+                output_format = sfnt_format
+            elif output_format not in WEB_FORMATS and output_format != sfnt_format:
+                outline_name = 'CFF' if sfnt_format == 'otf' else 'TrueType'
+                raise ValueError(f"基础字体为{outline_name}轮廓，不能输出{output_format}，请使用{sfnt_format}")
+            key = make_job_key(job, output_format)
+        except (ValueError, FontMergeError) as e:
+            self.stats['failed'] += 1
+            return self.json_result(400, {'error': str(e)})
+
+        output_path = os.path.join(self.output_dir, f"{key}.{output_format}")
+        future = self.in_flight.get(key)
+        if future is not None:
+            source = 'shared'
+        elif os.path.exists(output_path):
+            source = 'cache'
+        else:
+            if len(self.in_flight) >= self.max_queue:
+                self.stats['rejected'] += 1
+                return self.json_result(503, {'error': '排队的请求过多，请稍后重试'})
+            source = 'merge'
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, run_service_job, dict(job, output_path=output_path), self.options
+            )
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+
+        try:
+            if future is not None:
+                merge_time = await asyncio.shield(future)
+                if source == 'merge':
+                    self.merge_times.append(merge_time)
+            with open(output_path, 'rb') as f:
+                data = f.read()
+            # 更新访问时间，供淘汰时判断
+            os.utime(output_path)
+        except Exception as e:
+            self.stats['failed'] += 1
+            return self.json_result(500, {'error': str(e)})
+        if source == 'merge':
+            self.evict_outputs()
+
+        self.stats[{'merge': 'merged', 'shared': 'shared', 'cache': 'cache_hits'}[source]] += 1
+        elapsed = time.perf_counter() - start_time
+        self.latencies.append(elapsed)
+        return 200, OUTPUT_FORMATS[output_format], data, {
+            'X-Merge-Source': source,
+            'X-Merge-Key': key,
+            'X-Merge-Time': f"{elapsed:.4f}",
+        }
+
+    def check_job_paths(self, job):
+        # 请求只能读取字体目录中的文件，包括字体和子集的文本文件
+        paths = list(job['font_paths'])
+        for subset_config in job['font_subset_config'].values():
+            paths.extend(subset_config['text_files'])
+        for path in paths:
+            if not is_path_inside(path, self.font_dir):
+                raise ValueError(f"路径不在字体目录之内: {os.path.relpath(path, self.font_dir)}")
+
+    def evict_outputs(self):
+        # 按最近使用时间从旧到新删除缓存的输出，直到总大小不超过上限，正在合并的输出不会被删除
+        entries = []
+        for file_name in os.listdir(self.output_dir):
+            key, _, output_format = file_name.partition('.')
+            if output_format not in OUTPUT_FORMATS or key in self.in_flight:
+                continue
+            path = os.path.join(self.output_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total_size <= self.output_cache_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def get_stats(self):
+        latencies = list(self.latencies)
+        merge_times = list(self.merge_times)
+        to_ms = lambda value: round(value * 1000, 1) if value is not None else None
+        return dict(
+            self.stats,
+            in_flight=len(self.in_flight),
+            workers=self.workers,
+            latency_p50_ms=to_ms(get_percentile(latencies, 50)),
+            latency_p95_ms=to_ms(get_percentile(latencies, 95)),
+            merge_p50_ms=to_ms(get_percentile(merge_times, 50)),
+        )
+
+    def json_result(self, status, value):
+        return status, 'application/json; charset=utf-8', json.dumps(value, ensure_ascii=False).encode('utf-8'), {}
+
+    def write_json(self, writer, status, value, keep_alive):
+        self.write_response(writer, status, *self.json_result(status, value)[1:], keep_alive)
+
+    def write_response(self, writer, status, content_type, data, extra_headers, keep_alive):
+        lines = [
+            f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(data)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        lines.extend(f"{name}: {value}" for name, value in extra_headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+
+def run_service(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    # 在当前线程中运行服务，直到按下Ctrl+C
+    async def serve():
+        server = await service.start_server(host, port, unix_path)
+        address = unix_path or '{}:{}'.format(*server.sockets[0].getsockname()[:2])
+        print(f"合并服务已启动: {address}（{service.workers}个工作进程）", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
@@ -0,0 +1,62 @@
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.pens.t2CharStringPen import T2CharStringPen
+from fontTools.pens.transformPen import TransformPen
+from fontTools.pens.cu2quPen import Cu2QuPen
+
+# 在glyf（二次曲线）和CFF（三次曲线）字形之间转换轮廓，只处理被导入的字形
+# CFF字形写入glyf时用cu2qu把三次曲线转换为二次曲线，所有字形使用同一个误差上限
+
+# cu2qu的最大误差（相对于EM大小），与fontmake的默认值一致
+CU2QU_MAX_ERR_EM = 0.001
+
+def is_cff_font(font):
+    return 'CFF ' in font and 'glyf' not in font
+
+def get_cu2qu_max_err(units_per_em):
+    return CU2QU_MAX_ERR_EM * units_per_em
+
+def draw_glyph(glyph_set, glyph_name, pen, scale_factor=1.0):
+    glyph = glyph_set[glyph_name]
+    # 简单的glyf字形绘制时会按hmtx的左边距平移轮廓，合并字体的hmtx先于字形缩放，这里抵消平移，按glyf中的坐标转换
+    offset = 0
+    glyf_table = getattr(glyph_set, 'glyfTable', None)
+    if glyf_table is not None:
+        glyf_glyph = glyf_table[glyph_name]
+        if glyf_glyph.numberOfContours > 0:
+            offset = glyph.lsb - glyf_glyph.xMin
+    if scale_factor != 1.0 or offset:
+        pen = TransformPen(pen, (scale_factor, 0, 0, scale_factor, -offset * scale_factor, 0))
+    glyph.draw(pen)
+
+def convert_to_glyf_glyph(glyph_set, glyph_name, glyf_table, max_err, scale_factor=1.0):
+    # 把字形绘制为glyf字形，三次曲线转换为二次曲线
+    # CFF轮廓为逆时针方向，TrueType为顺时针方向，转换时同时反转轮廓方向
+    tt_pen = TTGlyphPen(None)
+    draw_glyph(glyph_set, glyph_name, Cu2QuPen(tt_pen, max_err, reverse_direction=True), scale_factor)
+    glyph = tt_pen.glyph()
+    glyph.recalcBounds(glyf_table)
+    return glyph
+
+def convert_to_charstring(glyph_set, glyph_name, cff, advance, scale_factor=1.0):
+    # 把字形绘制为CFF字形（二次曲线会转换为三次曲线），不使用子程序，提示信息不保留
+    # 宽度按基础字体Private字典中的nominalWidthX/defaultWidthX编码
+    # 复合字形通过glyph_set分解为轮廓，CFF字形没有组件
+    top_dict = cff.topDictIndex[0]
+    private = top_dict.Private
+    width = None if advance == private.defaultWidthX else advance - private.nominalWidthX
+    pen = T2CharStringPen(width, glyph_set)
+    draw_glyph(glyph_set, glyph_name, pen, scale_factor)
+    return pen.getCharString(private=private, globalSubrs=cff.GlobalSubrs)
+
+def add_charstring(cff, glyph_name, charstring):
+    # 在CFF中追加字形，字形名称由调用方追加到字形顺序（即CFF的charset）中
+    char_strings = cff.topDictIndex[0].CharStrings
+    if char_strings.charStringsAreIndexed:
+        char_strings.charStrings[glyph_name] = len(char_strings.charStringsIndex)
+        char_strings.charStringsIndex.append(charstring)
+    else:
+        char_strings.charStrings[glyph_name] = charstring
+
+def get_charstring_xmin(cff, charstring):
+    bounds = charstring.calcBounds(cff.topDictIndex[0].CharStrings)
+    return bounds[0] if bounds else 0
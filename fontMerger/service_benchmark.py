@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from benchmark import prepare_fonts
+from batch_merge import make_options
+from merge_service import MergeService
+
+# 合并服务的延迟和吞吐量基准测试：在当前进程中启动服务，用本地客户端发送请求，
+# 并与每次合并都启动新进程（python -m fontMerger merge）的方式对比
+#
+# 用法:
+#   python service_benchmark.py --size 10000 --requests 20 --concurrency 4
+#
+# 测试项目:
+#   fresh_process   每次合并启动新进程，包括解释器启动、导入和解析源字体
+#   service_miss    依次发送不同的请求，每个请求都需要合并
+#   service_hit     重复发送相同的请求，直接返回缓存的输出
+#   service_dedup   同时发送相同的新请求，只合并一次
+#   throughput      并发发送不同的请求
+
+DEFAULT_SIZE = 10000
+DEFAULT_REQUESTS = 20
+DEFAULT_CONCURRENCY = 4
+# 每个请求保留的合并字体码位数量
+SUBSET_SPAN = 2000
+SUBSET_START = 0x3400
+# 子集起点的变化范围，保持在合成字体的BMP码位之内
+SUBSET_OFFSET_RANGE = 4000
+
+def make_request(base_path, donor_path, index):
+    # 第index个不同的请求：码位子集和字体名称都不同
+    start = SUBSET_START + index * 97 % SUBSET_OFFSET_RANGE
+    return {
+        'font_paths': [base_path, donor_path],
+        'final_font_config': {'font_name': f"BenchService{index}", 'style_name': 'Regular'},
+        'font_subset_config': {
+            os.path.basename(donor_path): {'unicodes': [f"U+{start:04X}-{start + SUBSET_SPAN:04X}"]}
+        },
+    }
+
+async def post_merge(port, request):
+    # 发送一个合并请求，返回(状态码, 响应头, 响应数据, 耗时)
+    start_time = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        body = json.dumps(request).encode('utf-8')
+        writer.write(
+            f"POST /merge HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        data = await reader.readexactly(int(headers.get('content-length', 0)))
+    finally:
+        writer.close()
+    if status != 200:
+        raise RuntimeError(f"请求失败（{status}）: {data.decode('utf-8', 'replace')}")
+    return status, headers, data, time.perf_counter() - start_time
+
+async def send_requests(port, requests, concurrency):
+    # 以指定的并发数发送请求，返回各请求的耗时、来源以及总耗时
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(request):
+        async with semaphore:
+            _, headers, _, elapsed = await post_merge(port, request)
+            return elapsed, headers['x-merge-source']
+
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*(send(request) for request in requests))
+    return [elapsed for elapsed, _ in results], [source for _, source in results], time.perf_counter() - start_time
+
+def measure_fresh_process(base_path, donor_path, work_dir, count):
+    # 每次合并都启动新进程执行只有一个任务的清单，返回各次耗时
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for i in range(count):
+        manifest_path = os.path.join(work_dir, f"fresh-{i}.json")
+        job = dict(make_request(base_path, donor_path, 1000 + i), output_path=os.path.join(work_dir, f"fresh-{i}.ttf"))
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'jobs': [job]}, f)
+        start_time = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-m', os.path.basename(package_dir), 'merge', manifest_path, '-j', '1'],
+            cwd=os.path.dirname(package_dir), check=True, stdout=subprocess.DEVNULL
+        )
+        times.append(time.perf_counter() - start_time)
+    return times
+
+def format_times(name, times, total_time=None):
+    ordered = sorted(times)
+    line = (f"{name:<16}{len(times):>4}个请求  p50 {ordered[len(ordered) // 2] * 1000:>8.1f}ms  "
+            f"p95 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000:>8.1f}ms  "
+            f"最快{ordered[0] * 1000:>8.1f}ms")
+    if total_time is not None:
+        line += f"  {len(times) / total_time:>6.2f}请求/秒"
+    return line
+
+def run_service_benchmark(font_dir, size, request_count, concurrency, workers, fresh_count):
+    base_path, donor_paths = prepare_fonts(font_dir, [size])
+    donor_path = donor_paths[size]
+    work_dir = os.path.join(font_dir, 'service')
+    os.makedirs(work_dir, exist_ok=True)
+
+    print(format_times('fresh_process', measure_fresh_process(base_path, donor_path, work_dir, fresh_count)), flush=True)
+
+    # 输出缓存使用新的临时目录，复用字体目录时上次运行的输出不会被命中
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    service = MergeService(font_dir, output_dir, make_options(), workers=workers, preload_paths=[donor_path])
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        server = asyncio.run_coroutine_threadsafe(service.start_server(port=0), loop).result()
+        port = server.sockets[0].getsockname()[1]
+
+        requests = [make_request(base_path, donor_path, i) for i in range(request_count)]
+        times, _, _ = asyncio.run(send_requests(port, requests, 1))
+        print(format_times('service_miss', times), flush=True)
+        times, sources, _ = asyncio.run(send_requests(port, requests, 1))
+        print(f"{format_times('service_hit', times)}  命中{sources.count('cache')}次", flush=True)
+
+        dedup_request = make_request(base_path, donor_path, request_count)
+        times, sources, _ = asyncio.run(send_requests(port, [dedup_request] * concurrency, concurrency))
+        print(f"{format_times('service_dedup', times)}  合并{sources.count('merge')}次", flush=True)
+
+        requests = [make_request(base_path, donor_path, request_count + 1 + i) for i in range(request_count)]
+        times, _, total_time = asyncio.run(send_requests(port, requests, concurrency))
+        print(format_times('throughput', times, total_time), flush=True)
+
+        print(f"服务统计: {json.dumps(service.get_stats(), ensure_ascii=False)}")
+        server.close()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        service.shutdown()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='合并服务的延迟和吞吐量基准测试')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help='合并字体的字形数量，默认10000')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='每项发送的请求数量，默认20')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='并发请求数，默认4')
+    parser.add_argument('--workers', type=int, default=None, help='服务的工作进程数，默认等于CPU核心数')
+    parser.add_argument('--fresh', type=int, default=3, help='每次启动新进程合并的次数，默认3')
+    parser.add_argument('--font-dir', default=None, help='合成字体的保存目录，指定后可以在多次运行之间复用')
+    args = parser.parse_args(argv)
+
+    if args.font_dir:
+        run_service_benchmark(args.font_dir, args.size, args.requests, args.concurrency, args.workers, args.fresh)
+    else:
+        with tempfile.TemporaryDirectory() as font_dir:
+            run_service_benchmark(font_dir, args.size, args.requests, args.concurrency, args.workers, args.fresh)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
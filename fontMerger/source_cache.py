@@ -0,0 +1,75 @@
+import io
+import hashlib
+from collections import OrderedDict
+from fontTools.ttLib import TTFont
+
+# 解码后的单个字形在内存中大约占用的字节数，用于估算缓存大小
+GLYPH_MEMORY_ESTIMATE = 1024
+
+def hash_font_data(data):
+    # 以文件内容计算缓存键，不同路径下的同一字体会命中同一份缓存
+    return hashlib.sha256(data).hexdigest()
+
+class PreparedSource:
+    # 已解析的合并源字体，以及在某个缩放比例下已经缩放过的字形
+    def __init__(self, font, data_size, content_hash=None, scale_factor=1.0):
+        self.font = font
+        self.data_size = data_size
+        self.content_hash = content_hash
+        self.scale_factor = scale_factor
+        self.metrics_scaled = False
+        self.scaled_glyphs = set()
+        self.expanded_glyphs = set()
+
+    @classmethod
+    def from_data(cls, data, content_hash=None):
+        # 字体数据保存在内存中，延迟解析的表在之后的任务中也能继续读取
+        return cls(TTFont(io.BytesIO(data), lazy=True), len(data), content_hash)
+
+    def estimated_size(self):
+        # 原始数据加上已解码字形的粗略内存占用
+        return self.data_size * 2 + len(self.expanded_glyphs) * GLYPH_MEMORY_ESTIMATE
+
+class SourceCache:
+    # 一次批量运行中共享的合并源缓存，按(内容哈希, 目标高度)索引，超过内存上限时按LRU淘汰
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        source = self.entries.get(key)
+        if source is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return source
+
+    def put(self, key, source):
+        self.entries[key] = source
+        self.entries.move_to_end(key)
+        self.trim()
+
+    def total_size(self):
+        return sum(source.estimated_size() for source in self.entries.values())
+
+    def trim(self):
+        # 淘汰最久未使用的缓存，但始终保留最近使用的一项
+        total_size = self.total_size()
+        while total_size > self.max_bytes and len(self.entries) > 1:
+            _, source = self.entries.popitem(last=False)
+            total_size -= source.estimated_size()
+            source.font.close()
+
+    def clear(self):
+        for source in self.entries.values():
+            source.font.close()
+        self.entries.clear()
@@ -0,0 +1,83 @@
+import os
+import sys
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import TTFont
+from fontTools.ttLib.tables._c_m_a_p import CmapSubtable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from merge_engine import FontMergeEngine
+
+# 基础字体带有只包含BMP码位的format 12子表（内容与format 4子表相同）时，
+# 合并辅助平面码位不能再添加一个(3, 10)子表，否则保存时会因重复的子表而失败
+
+def make_glyph():
+    pen = TTGlyphPen(None)
+    pen.moveTo((50, 0))
+    pen.lineTo((50, 500))
+    pen.lineTo((550, 500))
+    pen.lineTo((550, 0))
+    pen.closePath()
+    return pen.glyph()
+
+def build_font(path, prefix, codes, bmp_only_format12=False):
+    glyph_order = ['.notdef'] + [f"{prefix}{i}" for i in range(len(codes))]
+    cmap = dict(zip(codes, glyph_order[1:]))
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyph_order)
+    builder.setupCharacterMap(cmap)
+    if bmp_only_format12:
+        table = CmapSubtable.newSubtable(12)
+        table.platformID = 3
+        table.platEncID = 10
+        table.language = 0
+        table.cmap = dict(cmap)
+        builder.font['cmap'].tables.append(table)
+    builder.setupGlyf({glyph_name: make_glyph() for glyph_name in glyph_order})
+    builder.setupHorizontalMetrics({glyph_name: (600, 50) for glyph_name in glyph_order})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({'familyName': prefix, 'styleName': 'Regular'})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(path)
+
+def get_subtable_keys(font):
+    return [(table.platformID, table.platEncID, table.language) for table in font['cmap'].tables]
+
+def check_output(output_path, codes):
+    font = TTFont(output_path)
+    keys = get_subtable_keys(font)
+    assert len(keys) == len(set(keys))
+    assert (3, 10, 0) in keys
+    cmap = font.getBestCmap()
+    assert all(code in cmap for code in codes)
+
+def test_supplementary_codes_with_bmp_only_format12(tmp_path):
+    base_path = str(tmp_path / 'base.ttf')
+    donor_path = str(tmp_path / 'donor.ttf')
+    output_path = str(tmp_path / 'output.ttf')
+    build_font(base_path, 'base', list(range(0x41, 0x5B)), bmp_only_format12=True)
+    build_font(donor_path, 'emoji', list(range(0x1F300, 0x1F310)))
+
+    FontMergeEngine([base_path, donor_path], output_path).run()
+    check_output(output_path, list(range(0x41, 0x5B)) + list(range(0x1F300, 0x1F310)))
+
+def test_incremental_rebuild_with_bmp_only_format12(tmp_path):
+    base_path = str(tmp_path / 'base.ttf')
+    first_path = str(tmp_path / 'first.ttf')
+    second_path = str(tmp_path / 'second.ttf')
+    output_path = str(tmp_path / 'output.ttf')
+    build_font(base_path, 'base', list(range(0x41, 0x5B)), bmp_only_format12=True)
+    build_font(first_path, 'emoji', list(range(0x1F300, 0x1F310)))
+    build_font(second_path, 'symbol', list(range(0x1F600, 0x1F608)))
+
+    font_paths = [base_path, first_path, second_path]
+    FontMergeEngine(font_paths, output_path, incremental=True).run()
+
+    # 第一个合并的字体变化后，截断会让format 12子表重新只剩BMP码位
+    build_font(first_path, 'emoji', list(range(0x1F300, 0x1F304)))
+    engine = FontMergeEngine(font_paths, output_path, incremental=True)
+    engine.run()
+    assert engine.reused_sources == 1
+    check_output(output_path, list(range(0x1F300, 0x1F304)) + list(range(0x1F600, 0x1F608)))
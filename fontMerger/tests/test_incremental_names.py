@@ -0,0 +1,62 @@
+import os
+import sys
+from fontTools.ttLib import TTFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from merge_engine import FontMergeEngine
+from test_cmap_merge import build_font
+
+# 源字体向name表添加的名称记录无法在截断字形时去掉，这样的源字体变化后增量构建应完整重新合并，
+# 否则输出会保留旧的名称记录，新的记录因名称ID已存在而不会被添加
+
+CUSTOM_NAME_ID = 256
+
+def build_donor(path, prefix, codes, custom_name):
+    build_font(path, prefix, codes)
+    font = TTFont(path)
+    font['name'].setName(custom_name, CUSTOM_NAME_ID, 3, 1, 0x409)
+    font.save(path)
+
+def get_custom_names(path):
+    font = TTFont(path)
+    return [record.toUnicode() for record in font['name'].names if record.nameID == CUSTOM_NAME_ID]
+
+def test_changed_source_with_name_records(tmp_path):
+    base_path = str(tmp_path / 'base.ttf')
+    first_path = str(tmp_path / 'first.ttf')
+    second_path = str(tmp_path / 'second.ttf')
+    output_path = str(tmp_path / 'output.ttf')
+    build_font(base_path, 'base', list(range(0x41, 0x5B)))
+    build_font(first_path, 'first', list(range(0x61, 0x7B)))
+    build_donor(second_path, 'second', list(range(0x4E00, 0x4E10)), 'Old Feature')
+
+    font_paths = [base_path, first_path, second_path]
+    FontMergeEngine(font_paths, output_path, incremental=True).run()
+    assert get_custom_names(output_path) == ['Old Feature']
+
+    build_donor(second_path, 'second', list(range(0x4E00, 0x4E08)), 'New Feature')
+    engine = FontMergeEngine(font_paths, output_path, incremental=True)
+    engine.run()
+    assert engine.reused_sources == 0
+    assert get_custom_names(output_path) == ['New Feature']
+
+def test_changed_source_without_name_records(tmp_path):
+    base_path = str(tmp_path / 'base.ttf')
+    first_path = str(tmp_path / 'first.ttf')
+    second_path = str(tmp_path / 'second.ttf')
+    output_path = str(tmp_path / 'output.ttf')
+    build_font(base_path, 'base', list(range(0x41, 0x5B)))
+    build_donor(first_path, 'first', list(range(0x61, 0x7B)), 'Kept Feature')
+    build_font(second_path, 'second', list(range(0x4E00, 0x4E10)))
+
+    font_paths = [base_path, first_path, second_path]
+    FontMergeEngine(font_paths, output_path, incremental=True).run()
+
+    # 只有没有添加名称记录的源字体变化时仍然保留之前的源字体
+    build_font(second_path, 'second', list(range(0x4E00, 0x4E08)))
+    engine = FontMergeEngine(font_paths, output_path, incremental=True)
+    engine.run()
+    assert engine.reused_sources == 2
+    assert get_custom_names(output_path) == ['Kept Feature']
@@ -0,0 +1,61 @@
+import os
+import sys
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import TTFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from merge_engine import FontMergeEngine
+from source_cache import SourceCache
+from test_cmap_merge import build_font
+
+# 同一批次的多个任务共享合并源缓存中已缩放的源字体，保存输出时不能改写其中的字形对象，
+# 否则复合字形会带着基础字体的组件GID留在缓存中，后续任务按源字体的字形顺序解码时引用错误的组件
+
+def make_glyph(x_offset):
+    pen = TTGlyphPen(None)
+    pen.moveTo((x_offset, 0))
+    pen.lineTo((x_offset, 400))
+    pen.lineTo((x_offset + 200, 400))
+    pen.lineTo((x_offset + 200, 0))
+    pen.closePath()
+    return pen.glyph()
+
+def build_composite_donor(path):
+    glyph_order = ['.notdef', 'part0', 'part1', 'combined']
+    pen = TTGlyphPen({'part0': None, 'part1': None})
+    pen.addComponent('part0', (1, 0, 0, 1, 0, 0))
+    pen.addComponent('part1', (1, 0, 0, 1, 300, 0))
+    glyphs = {'.notdef': make_glyph(50), 'part0': make_glyph(50), 'part1': make_glyph(100), 'combined': pen.glyph()}
+    builder = FontBuilder(2048, isTTF=True)
+    builder.setupGlyphOrder(glyph_order)
+    builder.setupCharacterMap({0x4E00: 'part0', 0x4E01: 'part1', 0x4E02: 'combined'})
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({glyph_name: (600, 50) for glyph_name in glyph_order})
+    builder.setupHorizontalHeader(ascent=1600, descent=-400)
+    builder.setupNameTable({'familyName': 'donor', 'styleName': 'Regular'})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(path)
+
+def test_shared_scaled_source_keeps_composites(tmp_path):
+    base_path = str(tmp_path / 'base.ttf')
+    other_base_path = str(tmp_path / 'other.ttf')
+    donor_path = str(tmp_path / 'donor.ttf')
+    build_font(base_path, 'base', list(range(0x41, 0x5B)))
+    # 第二个任务的基础字体字形数量不同，错误的组件GID会指向其他字形
+    build_font(other_base_path, 'other', list(range(0x61, 0x6B)))
+    build_composite_donor(donor_path)
+
+    source_cache = SourceCache(64 * 1024 * 1024)
+    font_scale_config = {'donor.ttf': {'enabled': True, 'target_height': 1000}}
+    for index, path in enumerate([base_path, other_base_path, base_path]):
+        output_path = str(tmp_path / f"output{index}.ttf")
+        FontMergeEngine([path, donor_path], output_path, font_scale_config, source_cache=source_cache).run()
+        font = TTFont(output_path)
+        cmap = font.getBestCmap()
+        component_names = font['glyf'][cmap[0x4E02]].getComponentNames(font['glyf'])
+        assert component_names == [cmap[0x4E00], cmap[0x4E01]]
+    assert source_cache.hits == 2
@@ -0,0 +1,46 @@
+import io
+import os
+from fontTools.ttLib import TTFont
+
+# 网页字体输出：把编译好的TrueType数据压缩为WOFF或WOFF2
+
+WEB_FORMATS = ('woff', 'woff2')
+
+def get_output_flavor(output_path):
+    # 按输出文件扩展名返回压缩格式，普通字体文件返回None
+    extension = os.path.splitext(output_path)[1].lower().lstrip('.')
+    return extension if extension in WEB_FORMATS else None
+
+def get_web_output_path(output_path, flavor):
+    # 与输出文件同名、扩展名为压缩格式的文件路径
+    return os.path.splitext(output_path)[0] + '.' + flavor
+
+def check_web_format(flavor):
+    # WOFF2使用Brotli压缩，brotli是可选依赖，只在需要时检查
+    if flavor not in WEB_FORMATS:
+        raise ValueError(f"不支持的网页字体格式: {flavor}")
+    if flavor == 'woff2':
+        try:
+            import brotli
+        except ImportError:
+            raise RuntimeError("输出WOFF2需要安装brotli（pip install brotli）")
+
+def compress_font_data(font_data, flavor):
+    # 返回压缩后的字体数据，表内容保持不变；flavor为None时返回未压缩的字体数据
+    if flavor is not None:
+        check_web_format(flavor)
+    font = TTFont(io.BytesIO(font_data), recalcBBoxes=False, recalcTimestamp=False)
+    try:
+        font.flavor = flavor
+        buffer = io.BytesIO()
+        font.save(buffer)
+    finally:
+        font.close()
+    return buffer.getvalue()
+
+def is_web_output_current(web_path, output_path):
+    # 压缩文件比输出文件新时不需要重新压缩
+    try:
+        return os.path.getmtime(web_path) >= os.path.getmtime(output_path)
+    except OSError:
+        return False